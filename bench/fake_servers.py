@@ -0,0 +1,251 @@
+# bench/fake_servers.py
+"""
+Локальные заглушки Telegram Bot API и Gemini/Veo API для нагрузочного теста.
+
+Бот направляется на них переменными окружения TELEGRAM_API_URL и GEMINI_API_URL.
+У обеих заглушек настраиваются задержка ответа и доля ошибок 5xx и 429,
+у Veo — длительность операции (LRO) и размер итогового видео.
+"""
+import asyncio
+import base64
+import io
+import itertools
+import json
+import random
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+from aiohttp import web
+
+
+@dataclass
+class FaultConfig:
+    latency: float = 0.05        # средняя задержка ответа, с
+    jitter: float = 0.5          # разброс задержки: доля от latency
+    error_rate: float = 0.0      # доля ответов 5xx
+    throttle_rate: float = 0.0   # доля ответов 429
+    retry_after: int = 1         # retry_after для 429 Telegram
+
+    async def delay(self):
+        if self.latency > 0:
+            spread = self.latency * self.jitter
+            await asyncio.sleep(max(0.0, random.uniform(self.latency - spread, self.latency + spread)))
+
+    def fault(self) -> str | None:
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return "throttle"
+        if roll < self.throttle_rate + self.error_rate:
+            return "error"
+        return None
+
+
+def sample_jpeg(width: int = 1280, height: int = 960) -> bytes:
+    """Настоящий JPEG для фото из обновлений (если Pillow недоступен — случайные байты)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return random.randbytes(200_000)
+    image = Image.merge("RGB", [Image.effect_noise((width, height), 48 + 16 * i) for i in range(3)])
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class FakeTelegram:
+    """
+    Заглушка Bot API: /bot<token>/<method> и /file/bot<token>/<path>.
+
+    Считает вызовы по методам и запоминает время доставки результатов
+    (sendVideo, sendPhoto, sendMediaGroup) и сообщений об ошибках по чатам.
+    """
+    SEND_RESULT_METHODS = {"sendvideo", "sendphoto", "sendmediagroup"}
+
+    def __init__(self, faults: FaultConfig, photo: bytes):
+        self.faults = faults
+        self.photo = photo
+        self.calls: dict[str, int] = defaultdict(int)
+        self.throttled = 0
+        self.errors = 0
+        self.deliveries: deque[tuple[float, int, str]] = deque()  # (время, chat_id, вид)
+        self._message_ids = itertools.count(1_000_000)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=200 * 1024 * 1024)
+        app.router.add_route("*", "/file/bot{token}/{path:.*}", self.handle_file)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        return app
+
+    def _message(self, chat_id: int, **extra) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **extra,
+        }
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        await self.faults.delay()
+        return web.Response(body=self.photo, content_type="image/jpeg")
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        await self.faults.delay()
+
+        fault = self.faults.fault()
+        if fault == "throttle":
+            self.throttled += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.faults.retry_after}",
+                "parameters": {"retry_after": self.faults.retry_after},
+            }, status=429)
+        if fault == "error":
+            self.errors += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method in self.SEND_RESULT_METHODS:
+            self.deliveries.append((time.monotonic(), chat_id, method))
+        elif method == "sendmessage" and str(params.get("text", "")).startswith("❌"):
+            self.deliveries.append((time.monotonic(), chat_id, "error"))
+
+        if method == "sendvideo":
+            video = {"file_id": uuid.uuid4().hex, "file_unique_id": uuid.uuid4().hex[:16],
+                     "width": 1280, "height": 720, "duration": 8}
+            result = self._message(chat_id, video=video)
+        elif method == "sendphoto":
+            photo = [{"file_id": uuid.uuid4().hex, "file_unique_id": uuid.uuid4().hex[:16], "width": 1024, "height": 1024}]
+            result = self._message(chat_id, photo=photo)
+        elif method == "sendmediagroup":
+            media = json.loads(params.get("media", "[]"))
+            result = [self._message(chat_id, photo=[{"file_id": uuid.uuid4().hex, "file_unique_id": uuid.uuid4().hex[:16],
+                                                     "width": 1024, "height": 1024}]) for _ in media]
+        elif method in ("sendmessage", "editmessagetext"):
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "getfile":
+            result = {"file_id": params.get("file_id"), "file_unique_id": "fake", "file_size": len(self.photo),
+                      "file_path": f"photos/{params.get('file_id')}.jpg"}
+        elif method == "getwebhookinfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "getme":
+            result = {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+        else:
+            # setWebhook, deleteWebhook, deleteMessage, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeGemini:
+    """
+    Заглушка Gemini API: generateContent, predict (Imagen), predictLongRunning (Veo),
+    опрос операций и скачивание готовых видео.
+    """
+    def __init__(self, faults: FaultConfig, lro_duration: float, lro_jitter: float, video_bytes: int):
+        self.faults = faults
+        self.lro_duration = lro_duration
+        self.lro_jitter = lro_jitter
+        self.video = random.randbytes(video_bytes)
+        self.image = sample_jpeg(256, 256)
+        self.base_url = ""
+        self.calls: dict[str, int] = defaultdict(int)
+        self.throttled = 0
+        self.errors = 0
+        self._operations: dict[str, float] = {}  # имя -> время готовности
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=200 * 1024 * 1024)
+        app.router.add_get("/download/{name}", self.handle_download)
+        app.router.add_route("*", "/{version}/{path:.*}", self.handle_api)
+        return app
+
+    def _fault_response(self) -> web.Response | None:
+        fault = self.faults.fault()
+        if fault == "throttle":
+            self.throttled += 1
+            return web.json_response(
+                {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}},
+                status=429,
+            )
+        if fault == "error":
+            self.errors += 1
+            return web.json_response({"error": {"code": 500, "message": "Internal error", "status": "INTERNAL"}}, status=500)
+        return None
+
+    async def handle_download(self, request: web.Request) -> web.Response:
+        self.calls["download"] += 1
+        return web.Response(body=self.video, content_type="video/mp4")
+
+    async def handle_api(self, request: web.Request) -> web.Response:
+        path = request.match_info["path"]
+        action = path.rsplit(":", 1)[1] if ":" in path else "getOperation"
+        self.calls[action] += 1
+        body = await request.json() if request.can_read_body else {}
+        await self.faults.delay()
+        fault = self._fault_response()
+        if fault is not None:
+            return fault
+
+        if action == "generateContent":
+            return web.json_response(self._generate_content(body))
+        if action == "predict":
+            count = int(body.get("parameters", {}).get("sampleCount", 1))
+            encoded = base64.b64encode(self.image).decode()
+            return web.json_response({"predictions": [{"bytesBase64Encoded": encoded, "mimeType": "image/jpeg"}] * count})
+        if action == "predictLongRunning":
+            model = path.split(":", 1)[0]
+            name = f"{model}/operations/{uuid.uuid4().hex}"
+            spread = self.lro_duration * self.lro_jitter
+            self._operations[name] = time.monotonic() + random.uniform(self.lro_duration - spread, self.lro_duration + spread)
+            return web.json_response({"name": name})
+        if action == "getOperation":
+            return web.json_response(self._operation(path))
+        return web.json_response({"error": {"code": 404, "message": f"Unknown method {path}", "status": "NOT_FOUND"}}, status=404)
+
+    def _generate_content(self, body: dict) -> dict:
+        contents = body.get("contents") or [{}]
+        prompt = "".join(part.get("text", "") for part in contents[-1].get("parts", []))
+        config = body.get("generationConfig", {})
+        if config.get("responseMimeType") == "application/json":
+            # Пакетный запрос: ответ — JSON-массив той же длины, что и вход
+            try:
+                items = json.loads(prompt)
+            except ValueError:
+                items = [prompt]
+            text = json.dumps([f"cinematic, detailed: {item}" for item in items], ensure_ascii=False)
+        else:
+            text = f"cinematic, detailed: {prompt}"
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+        }
+
+    def _operation(self, name: str) -> dict:
+        ready_at = self._operations.get(name)
+        if ready_at is None:
+            return {"name": name, "done": True, "error": {"code": 404, "message": "operation not found"}}
+        if time.monotonic() < ready_at:
+            return {"name": name, "done": False}
+        video_name = name.rsplit("/", 1)[-1]
+        return {
+            "name": name,
+            "done": True,
+            "response": {
+                "@type": "type.googleapis.com/google.ai.generativelanguage.v1beta.PredictLongRunningResponse",
+                "generateVideoResponse": {"generatedSamples": [{"video": {"uri": f"{self.base_url}/download/{video_name}.mp4"}}]},
+            },
+        }
+
+
+async def start_app(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
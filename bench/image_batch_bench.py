@@ -0,0 +1,76 @@
+# bench/image_batch_bench.py
+"""
+Генерация изображений: число вызовов модели и задержка на изображение.
+
+Заглушка Imagen отвечает за `--latency + --per-image * N` секунд на вызов с N
+вариантами (один вызов дешевле N отдельных). Режимы:
+  single    — N отдельных вызовов number_of_images=1 (как было раньше);
+  batched   — один вызов number_of_images=N (GeminiGenerator.generate_images);
+  coalesced — `--duplicates` одновременных одинаковых запросов по N вариантов:
+              к модели уходит один вызов, результат получают все.
+
+Запуск:  python bench/image_batch_bench.py --variants 4 --duplicates 5 --latency 4 --per-image 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import GeminiGenerator
+
+
+class StubImagen:
+    def __init__(self, latency: float, per_image: float):
+        self.latency = latency
+        self.per_image = per_image
+        self.calls = 0
+
+    async def generate_images(self, model, prompt, config):
+        self.calls += 1
+        count = config["number_of_images"]
+        await asyncio.sleep(self.latency + self.per_image * count)
+        images = [SimpleNamespace(image=SimpleNamespace(image_bytes=b"\xff\xd8" + bytes(1024))) for _ in range(count)]
+        return SimpleNamespace(generated_images=images)
+
+
+async def run_mode(mode: str, args) -> dict:
+    stub = StubImagen(args.latency, args.per_image)
+    client = SimpleNamespace(aio=SimpleNamespace(models=stub))
+    generator = GeminiGenerator(client=client, image_model="stub", max_concurrent=args.max_concurrent)
+    started = time.perf_counter()
+    if mode == "single":
+        results = await asyncio.gather(*(generator.generate_images(f"замок #{i}", 1) for i in range(args.variants)))
+        images = sum(len(r) for r in results)
+    elif mode == "batched":
+        images = len(await generator.generate_images("замок", args.variants))
+    else:
+        results = await asyncio.gather(*(generator.generate_images("замок", args.variants) for _ in range(args.duplicates)))
+        images = sum(len(r) for r in results)
+    elapsed = time.perf_counter() - started
+    return {"mode": mode, "calls": stub.calls, "images": images, "elapsed_s": elapsed,
+            "per_image_s": elapsed / max(1, images)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", type=int, default=4)
+    parser.add_argument("--duplicates", type=int, default=5, help="одинаковых одновременных запросов в режиме coalesced")
+    parser.add_argument("--latency", type=float, default=4.0, help="постоянная часть задержки вызова, с")
+    parser.add_argument("--per-image", type=float, default=0.5, help="добавка к задержке за каждый вариант, с")
+    parser.add_argument("--max-concurrent", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"variants={args.variants} duplicates={args.duplicates} latency={args.latency}s per_image={args.per_image}s "
+          f"max_concurrent={args.max_concurrent}")
+    print(f"{'mode':<10} {'calls':>6} {'images':>7} {'elapsed,s':>10} {'s/image':>8}")
+    for mode in ("single", "batched", "coalesced"):
+        r = asyncio.run(run_mode(mode, args))
+        print(f"{r['mode']:<10} {r['calls']:>6} {r['images']:>7} {r['elapsed_s']:>10.2f} {r['per_image_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
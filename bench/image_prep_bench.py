@@ -0,0 +1,91 @@
+# bench/image_prep_bench.py
+"""
+Подготовка фото для Veo: размер отправляемых данных и задержка цикла событий.
+
+Генерирует фото как с камеры телефона (JPEG высокого качества с EXIF) и
+сравнивает три режима:
+  raw    — байты из Telegram уходят в Veo как есть (как было раньше);
+  inline — prepare_image вызывается прямо в корутине (CPU в цикле событий);
+  pool   — ImagePreprocessor (ProcessPoolExecutor, как сейчас в main.py).
+
+Запуск:  python bench/image_prep_bench.py --photos 16 --width 4032 --height 3024
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from image_prep import ImagePreprocessor, aspect_size, prepare_image
+from loop_lag import LoopLagMonitor
+
+
+def camera_photo(width: int, height: int) -> bytes:
+    image = Image.merge("RGB", [Image.effect_noise((width, height), 32 + 8 * i) for i in range(3)])
+    exif = Image.Exif()
+    exif[0x0112] = 6                          # Orientation: повернуть на 90°
+    exif[0x010F] = "BenchCam"                 # Make
+    exif[0x9286] = "x" * 32_000               # UserComment: крупные метаданные
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+async def run_mode(mode: str, photos: list[bytes], workers: int, target: tuple[int, int]) -> dict:
+    monitor = LoopLagMonitor(interval=0.01, warn_threshold=float("inf"))
+    preprocessor = ImagePreprocessor(width=target[0], workers=workers)
+    if mode == "pool":
+        await preprocessor.start()
+    monitor.start()
+    await asyncio.sleep(0)  # монитор засекает время до начала работы
+    started = time.perf_counter()
+
+    async def one(data: bytes) -> int:
+        if mode == "raw":
+            return len(data)
+        if mode == "inline":
+            return len(prepare_image(data, target).data)
+        return len((await preprocessor.prepare(data)).data)
+
+    sizes = await asyncio.gather(*(one(data) for data in photos))
+    elapsed = time.perf_counter() - started
+    # В режиме inline цикл был занят все время: монитор должен проснуться и
+    # записать эту задержку до остановки, иначе замеров не будет вовсе
+    await asyncio.sleep(monitor.interval * 2)
+    await monitor.stop()
+    await preprocessor.close()
+    return {
+        "mode": mode,
+        "elapsed_s": elapsed,
+        "avg_kb": sum(sizes) / len(sizes) / 1024,
+        "lag_p99_ms": monitor.percentile(99) * 1000,
+        "lag_max_ms": monitor.max_lag * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=16, help="число фото, обрабатываемых одновременно")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--workers", type=int, default=2, help="процессов в пуле")
+    parser.add_argument("--target-width", type=int, default=1280)
+    args = parser.parse_args()
+
+    photo = camera_photo(args.width, args.height)
+    photos = [photo] * args.photos
+    target = aspect_size("16:9", args.target_width)
+    print(f"photos={args.photos} source={args.width}x{args.height} ({len(photo) / 1024:.0f} KB) target={target[0]}x{target[1]}")
+    print(f"{'mode':<7} {'elapsed,s':>10} {'avg KB':>8} {'lag p99,ms':>11} {'lag max,ms':>11}")
+    for mode in ("raw", "inline", "pool"):
+        r = asyncio.run(run_mode(mode, photos, args.workers, target))
+        print(f"{r['mode']:<7} {r['elapsed_s']:>10.2f} {r['avg_kb']:>8.0f} {r['lag_p99_ms']:>11.1f} {r['lag_max_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
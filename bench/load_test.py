@@ -0,0 +1,322 @@
+# bench/load_test.py
+"""
+Сквозной нагрузочный тест бота без реальных Telegram и Veo.
+
+Бот (main.py) запускается отдельным процессом и направляется на локальные
+заглушки (bench/fake_servers.py) через TELEGRAM_API_URL и GEMINI_API_URL.
+Нагрузка — синтетические обновления Telegram (`/video ...` и фото с подписью
+`#veo ...`), отправляемые на вебхук с заданной частотой по открытой модели:
+следующий запрос не ждет ответа на предыдущий.
+
+Отчет:
+  - задержка ответа вебхука p50/p99/max (на стороне отправителя);
+  - завершенные задачи в секунду и сквозная задержка задачи p50/p99;
+  - пиковый RSS процесса бота;
+  - задержка цикла событий бота (по /metrics: p99 выборок и максимум);
+  - число вызовов и внедренных ошибок/429 на каждой заглушке.
+
+Запуск:
+  python bench/load_test.py --rate 20 --duration 30 --users 50 --photo-ratio 0.3 \
+      --lro 8 --gemini-latency 0.3 --telegram-throttle 0.02 --gemini-throttle 0.05
+
+Переменные окружения бота можно переопределить: --bot-env JOB_WORKERS=16 --bot-env VEO_MAX_CONCURRENT=16
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+import aiohttp
+
+from fake_servers import FakeGemini, FakeTelegram, FaultConfig, sample_jpeg, start_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "123456:LOAD-TEST-TOKEN"
+WEBHOOK_SECRET = "load-test"
+
+PROMPTS = [
+    "кот играет с клубком на закате",
+    "дрон пролетает над горным озером",
+    "дождь в неоновом городе ночью",
+    "волны разбиваются о скалы",
+    "воздушный шар над полем лаванды",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def peak_rss_mb(pid: int) -> float:
+    """Пиковый RSS процесса (VmHWM, только Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def parse_metrics(text: str) -> dict[str, float]:
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, _, value = line.partition(" ")
+            try:
+                values[name] = float(value)
+            except ValueError:
+                pass
+    return values
+
+
+class UpdateFactory:
+    """Синтетические обновления Telegram: текст `/video` или фото с подписью `#veo`."""
+    def __init__(self, users: int, photo_ratio: float, distinct_prompts: int):
+        self.users = users
+        self.photo_ratio = photo_ratio
+        self.distinct_prompts = distinct_prompts
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _prompt(self, n: int) -> str:
+        base = PROMPTS[n % len(PROMPTS)]
+        if self.distinct_prompts:
+            return f"{base} #{n % self.distinct_prompts}"
+        return f"{base} #{n}"
+
+    def make(self) -> tuple[int, dict]:
+        update_id = next(self._update_ids)
+        user_id = 10_000 + random.randrange(self.users)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        }
+        prompt = self._prompt(update_id)
+        if random.random() < self.photo_ratio:
+            file_id = f"photo-{update_id}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+            message["caption"] = f"#veo {prompt}"
+        else:
+            message["text"] = f"/video {prompt}"
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+        return user_id, {"update_id": update_id, "message": message}
+
+
+async def wait_ready(session: aiohttp.ClientSession, url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Бот завершился при запуске (код {process.returncode})")
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError("Бот не ответил на /metrics вовремя")
+
+
+async def sample_loop_lag(session: aiohttp.ClientSession, url: str, samples: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            async with session.get(url) as response:
+                metrics = parse_metrics(await response.text())
+            samples.append(metrics.get("bot_event_loop_lag_seconds", 0.0))
+        except aiohttp.ClientError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args):
+    telegram_faults = FaultConfig(args.telegram_latency, error_rate=args.telegram_errors, throttle_rate=args.telegram_throttle)
+    gemini_faults = FaultConfig(args.gemini_latency, error_rate=args.gemini_errors, throttle_rate=args.gemini_throttle)
+    fake_telegram = FakeTelegram(telegram_faults, sample_jpeg())
+    fake_gemini = FakeGemini(gemini_faults, args.lro, args.lro_jitter, int(args.video_mb * 1024 * 1024))
+
+    telegram_port, gemini_port, bot_port = free_port(), free_port(), free_port()
+    fake_gemini.base_url = f"http://127.0.0.1:{gemini_port}"
+    runners = [
+        await start_app(fake_telegram.app(), "127.0.0.1", telegram_port),
+        await start_app(fake_gemini.app(), "127.0.0.1", gemini_port),
+    ]
+
+    workdir = tempfile.mkdtemp(prefix="bot-load-")
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "GEMINI_API_KEY": "load-test-key",
+        "WEBHOOK_HOST": f"http://127.0.0.1:{bot_port}",
+        "TG_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "PORT": str(bot_port),
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram_port}",
+        "GEMINI_API_URL": fake_gemini.base_url,
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "VEO_EXPECTED_SECONDS": str(args.lro),
+        # Лимиты на пользователя не должны маскировать пропускную способность
+        "USER_REQUESTS_PER_HOUR": "1000000",
+        "USER_REQUESTS_BURST": "1000000",
+        "USER_MAX_QUEUED": "1000",
+        "JOB_QUEUE_SIZE": "100000",
+    }
+    for item in args.bot_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    log_path = os.path.join(workdir, "bot.log")
+    log_file = open(log_path, "w")
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=workdir, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    bot_url = f"http://127.0.0.1:{bot_port}"
+    webhook_url = f"{bot_url}/webhook/{WEBHOOK_SECRET}"
+
+    factory = UpdateFactory(args.users, args.photo_ratio, args.distinct_prompts)
+    webhook_latencies: list[float] = []
+    webhook_failures = 0
+    sent_at: dict[int, deque[float]] = defaultdict(deque)
+    lag_samples: list[float] = []
+    stop_sampling = asyncio.Event()
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        try:
+            await wait_ready(session, f"{bot_url}/metrics", process)
+            sampler = asyncio.create_task(sample_loop_lag(session, f"{bot_url}/metrics", lag_samples, stop_sampling))
+
+            async def post(user_id: int, update: dict):
+                nonlocal webhook_failures
+                started = time.monotonic()
+                try:
+                    async with session.post(webhook_url, json=update) as response:
+                        await response.read()
+                        ok = response.status == 200
+                except aiohttp.ClientError:
+                    ok = False
+                webhook_latencies.append(time.monotonic() - started)
+                if ok:
+                    sent_at[user_id].append(started)
+                else:
+                    webhook_failures += 1
+
+            print(f"Нагрузка: {args.rate} обновлений/с в течение {args.duration} с, пользователей: {args.users}")
+            tasks = []
+            load_started = time.monotonic()
+            total = int(args.rate * args.duration)
+            for i in range(total):
+                # Открытая модель: отправляем по расписанию, не дожидаясь ответов
+                delay = load_started + i / args.rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(post(*factory.make())))
+            await asyncio.gather(*tasks)
+
+            # Ждем доставки результатов (видео или сообщения об ошибке) по всем задачам
+            drain_deadline = time.monotonic() + args.drain
+            accepted = total - webhook_failures
+            while len(fake_telegram.deliveries) < accepted and time.monotonic() < drain_deadline:
+                await asyncio.sleep(0.5)
+            finished_at = time.monotonic()
+
+            async with session.get(f"{bot_url}/metrics") as response:
+                final_metrics = parse_metrics(await response.text())
+            stop_sampling.set()
+            await sampler
+            rss = peak_rss_mb(process.pid)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log_file.close()
+            for runner in runners:
+                await runner.cleanup()
+
+    # Сопоставляем доставки с отправкой по чатам (задачи одного пользователя идут по порядку)
+    job_latencies = []
+    kinds: dict[str, int] = defaultdict(int)
+    last_delivery = load_started
+    for delivered_at, chat_id, kind in fake_telegram.deliveries:
+        kinds[kind] += 1
+        last_delivery = max(last_delivery, delivered_at)
+        if sent_at.get(chat_id):
+            job_latencies.append(delivered_at - sent_at[chat_id].popleft())
+    completed = len(fake_telegram.deliveries)
+    elapsed = max(1e-9, last_delivery - load_started)
+
+    report = {
+        "updates_sent": total,
+        "webhook_failures": webhook_failures,
+        "webhook_p50_ms": round(percentile(webhook_latencies, 50) * 1000, 2),
+        "webhook_p99_ms": round(percentile(webhook_latencies, 99) * 1000, 2),
+        "webhook_max_ms": round(max(webhook_latencies, default=0) * 1000, 2),
+        "jobs_completed": completed,
+        "jobs_by_outcome": dict(kinds),
+        "jobs_per_sec": round(completed / elapsed, 3),
+        "job_latency_p50_s": round(percentile(job_latencies, 50), 2),
+        "job_latency_p99_s": round(percentile(job_latencies, 99), 2),
+        "unfinished_after_drain": max(0, accepted - completed),
+        "bot_peak_rss_mb": round(rss, 1),
+        "loop_lag_p99_ms": round(percentile(lag_samples, 99) * 1000, 2),
+        "loop_lag_max_ms": round(final_metrics.get("bot_event_loop_lag_max_seconds", 0.0) * 1000, 2),
+        "telegram_calls": dict(fake_telegram.calls),
+        "telegram_injected": {"throttled": fake_telegram.throttled, "errors": fake_telegram.errors},
+        "gemini_calls": dict(fake_gemini.calls),
+        "gemini_injected": {"throttled": fake_gemini.throttled, "errors": fake_gemini.errors},
+        "wall_time_s": round(finished_at - load_started, 1),
+        "bot_log": log_path,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=10, help="обновлений в секунду")
+    parser.add_argument("--duration", type=float, default=20, help="длительность нагрузки, с")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--photo-ratio", type=float, default=0.3, help="доля обновлений с фото (#veo)")
+    parser.add_argument("--distinct-prompts", type=int, default=0, help="число разных промптов (0 — все уникальны)")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--telegram-errors", type=float, default=0.0)
+    parser.add_argument("--telegram-throttle", type=float, default=0.0)
+    parser.add_argument("--gemini-latency", type=float, default=0.2)
+    parser.add_argument("--gemini-errors", type=float, default=0.0)
+    parser.add_argument("--gemini-throttle", type=float, default=0.0)
+    parser.add_argument("--lro", type=float, default=5.0, help="средняя длительность операции Veo, с")
+    parser.add_argument("--lro-jitter", type=float, default=0.3)
+    parser.add_argument("--video-mb", type=float, default=2.0)
+    parser.add_argument("--drain", type=float, default=120.0, help="сколько ждать завершения задач после нагрузки, с")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--output", help="сохранить отчет в JSON-файл")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# bench/loop_lag_bench.py
+"""
+Замер задержки цикла событий при N одновременных задачах генерации.
+
+Гоняет настоящий код бота из main.py — enhance_prompt (кэш промптов и
+пакетирование), launch_veo_operation (запуск Veo и запись в хранилище задач)
+и общий опросчик OperationTracker — против заглушки клиента Gemini с заданной
+задержкой. Задержка цикла событий снимается LoopLagMonitor бота. Режимы:
+  blocking — заглушка блокирует поток на время вызова (синхронный SDK внутри
+             корутины, как было раньше);
+  async    — заглушка ждет через asyncio (client.aio, как сейчас).
+
+Нужны зависимости бота (aiogram, google-genai); Telegram и Gemini не вызываются:
+правки статусов остаются в очереди TelegramSender, а клиент Gemini подменен.
+
+Запуск:  python bench/loop_lag_bench.py --jobs 20 --latency 0.2 --polls 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubGemini:
+    """Заглушка genai.Client с интерфейсом client.aio.models / client.aio.operations."""
+    def __init__(self, latency: float, polls: int):
+        self.latency = latency
+        self.polls = polls
+        self.blocking = False
+        self.calls = 0
+        self._operations = 0
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self.generate_content, generate_videos=self.generate_videos),
+            operations=SimpleNamespace(get=self.get_operation),
+        )
+
+    async def _call(self):
+        self.calls += 1
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+
+    async def generate_content(self, model, contents, config):
+        await self._call()
+        if getattr(config, "response_mime_type", None) == "application/json":
+            prompts = json.loads(contents[0])
+            return SimpleNamespace(text=json.dumps([f"{p}, кинематографичный свет" for p in prompts], ensure_ascii=False))
+        return SimpleNamespace(text=f"{contents[0]}, кинематографичный свет")
+
+    async def generate_videos(self, model, prompt, config, image=None):
+        await self._call()
+        self._operations += 1
+        return SimpleNamespace(name=f"operations/stub-{self._operations}", done=False, polls_left=self.polls, response=None)
+
+    async def get_operation(self, operation):
+        await self._call()
+        polls_left = operation.polls_left - 1
+        return SimpleNamespace(name=operation.name, done=polls_left <= 0, polls_left=polls_left, response=None)
+
+
+async def run_job(bot_main, mode: str, index: int):
+    """Путь задачи 'Текст в Видео' до получения готовой операции (без доставки в Telegram)."""
+    job_id = f"{mode}-{index}"
+    bot_main.job_store.add(job_id, chat_id=index, user_id=index, status_message_id=index, prompt=f"кот #{index}")
+    await bot_main.job_store.flush()
+    enhanced_prompt = await bot_main.enhance_prompt(f"{mode}: кот на солнце #{index}")
+    operation = await bot_main.launch_veo_operation(job_id, index, enhanced_prompt, index, None, 2)
+    await bot_main.operation_tracker.wait(operation)
+
+
+async def run(bot_main, stub: StubGemini, jobs: int) -> list[dict]:
+    await bot_main.job_store.open()
+    bot_main.operation_tracker.start()
+    monitor = bot_main.loop_lag_monitor
+    monitor.start()
+    results = []
+    for mode in ("blocking", "async"):
+        stub.blocking = mode == "blocking"
+        stub.calls = 0
+        monitor.reset()
+        started = time.perf_counter()
+        await asyncio.gather(*(run_job(bot_main, mode, i) for i in range(jobs)))
+        elapsed = time.perf_counter() - started
+        results.append({
+            "mode": mode,
+            "calls": stub.calls,
+            "elapsed_s": elapsed,
+            "lag_p50_ms": monitor.percentile(50) * 1000,
+            "lag_p99_ms": monitor.percentile(99) * 1000,
+            "lag_max_ms": monitor.max_lag * 1000,
+        })
+    await monitor.stop()
+    await bot_main.operation_tracker.stop()
+    await bot_main.prompt_batcher.close()
+    await bot_main.job_store.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=20, help="число одновременных задач")
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка одного вызова заглушки, с")
+    parser.add_argument("--polls", type=int, default=5, help="число опросов LRO на задачу")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="минимальная пауза между опросами, с")
+    args = parser.parse_args()
+
+    # Окружение до импорта main.py: бот читает настройки при импорте
+    workdir = tempfile.mkdtemp(prefix="loop-lag-bench-")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("WEBHOOK_HOST", "https://bench.invalid")
+    os.environ["JOB_DB_PATH"] = os.path.join(workdir, "jobs.db")
+    os.environ["VEO_EXPECTED_SECONDS"] = str(args.poll_interval * 2)
+    os.environ["VEO_POLLS_PER_SECOND"] = "1000"
+    import main as bot_main
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stub = StubGemini(args.latency, args.polls)
+    bot_main.gemini_client = stub
+    bot_main.loop_lag_monitor.interval = 0.01
+    bot_main.loop_lag_monitor.warn_threshold = float("inf")
+    bot_main.operation_tracker.min_interval = args.poll_interval
+
+    print(f"jobs={args.jobs} latency={args.latency}s polls={args.polls}")
+    print(f"{'mode':<9} {'calls':>6} {'elapsed,s':>10} {'lag p50,ms':>11} {'lag p99,ms':>11} {'lag max,ms':>11}")
+    for r in asyncio.run(run(bot_main, stub, args.jobs)):
+        print(f"{r['mode']:<9} {r['calls']:>6} {r['elapsed_s']:>10.2f} {r['lag_p50_ms']:>11.1f} "
+              f"{r['lag_p99_ms']:>11.1f} {r['lag_max_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# bench/media_memory_bench.py
+"""
+Пиковое потребление памяти (RSS) на одновременную задачу для медиапути.
+
+  before — как было: фото -> base64-строка -> dict inlineData; видео приходит
+           base64-строкой, декодируется целиком и отправляется из буфера.
+  after  — как сейчас: сырые байты фото передаются в SDK, а видео скачивается
+           настоящим media.video_input_file с локального сервера (крупные
+           файлы — частями во временный файл) и загружается с диска.
+
+В обоих режимах видео загружается настоящим bot.send_video (aiogram) в
+заглушку Bot API. Заглушки (bench/fake_servers.py) работают в основном
+процессе, а каждый режим — в отдельном, чтобы пики RSS не смешивались и
+не включали буферы серверов.
+
+Запуск:  python bench/media_memory_bench.py --jobs 8 --photo-mb 1 --video-mb 20
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import BufferedInputFile
+
+from fake_servers import FakeGemini, FakeTelegram, FaultConfig, start_app
+from media import close_session, video_input_file
+
+BOT_TOKEN = "123456:bench"
+TELEGRAM_PORT = 18081
+GEMINI_PORT = 18082
+
+
+def rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def job_before(bot: Bot, photo: bytes, video_b64: str, barrier: asyncio.Barrier):
+    image_input = {"inlineData": {"data": base64.b64encode(photo).decode("utf-8"), "mimeType": "image/jpeg"}}
+    video_bytes = base64.b64decode(video_b64)
+    await barrier.wait()  # все задачи держат буферы одновременно
+    await bot.send_video(chat_id=1, video=BufferedInputFile(video_bytes, filename="generated_video.mp4"))
+    return len(image_input["inlineData"]["data"])
+
+
+async def job_after(bot: Bot, photo: bytes, video_uri: str, barrier: asyncio.Barrier):
+    image_input = photo  # передается в SDK как есть
+    video = SimpleNamespace(video_bytes=None, uri=video_uri)
+    async with video_input_file(video, api_key="bench") as video_file:
+        await barrier.wait()
+        await bot.send_video(chat_id=1, video=video_file)
+    return len(image_input)
+
+
+async def run(mode: str, jobs: int, photo_mb: float, video_mb: float) -> dict:
+    photo_size = int(photo_mb * 1024 * 1024)
+    video_size = int(video_mb * 1024 * 1024)
+    bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{TELEGRAM_PORT}")))
+    baseline = rss_mb()
+    barrier = asyncio.Barrier(jobs)
+    try:
+        if mode == "before":
+            # Ответ SDK с base64-строкой видео для каждой задачи
+            tasks = [job_before(bot, os.urandom(photo_size), base64.b64encode(os.urandom(video_size)).decode("ascii"), barrier)
+                     for _ in range(jobs)]
+        else:
+            video_uri = f"http://127.0.0.1:{GEMINI_PORT}/download/video.mp4"
+            tasks = [job_after(bot, os.urandom(photo_size), video_uri, barrier) for _ in range(jobs)]
+        await asyncio.gather(*tasks)
+    finally:
+        await close_session()
+        await bot.session.close()
+    peak = rss_mb()
+    return {"mode": mode, "baseline_mb": baseline, "peak_mb": peak, "per_job_mb": (peak - baseline) / jobs}
+
+
+async def compare(args) -> list[dict]:
+    """Поднимает заглушки и по очереди запускает режимы в отдельных процессах."""
+    faults = FaultConfig(latency=0.0)
+    fake_telegram = FakeTelegram(faults, photo=b"")
+    fake_gemini = FakeGemini(faults, lro_duration=0.0, lro_jitter=0.0, video_bytes=int(args.video_mb * 1024 * 1024))
+    runners = [
+        await start_app(fake_telegram.app(), "127.0.0.1", TELEGRAM_PORT),
+        await start_app(fake_gemini.app(), "127.0.0.1", GEMINI_PORT),
+    ]
+    results = []
+    try:
+        for mode in ("before", "after"):
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, __file__, "--mode", mode, "--jobs", str(args.jobs),
+                "--photo-mb", str(args.photo_mb), "--video-mb", str(args.video_mb),
+                stdout=asyncio.subprocess.PIPE,
+            )
+            out, _ = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"режим {mode} завершился с кодом {process.returncode}")
+            results.append(json.loads(out.decode().strip().splitlines()[-1]))
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+    if fake_telegram.calls["sendvideo"] != 2 * args.jobs:
+        raise RuntimeError(f"ожидалось {2 * args.jobs} загрузок видео, получено {fake_telegram.calls['sendvideo']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=8, help="число одновременных задач")
+    parser.add_argument("--photo-mb", type=float, default=1.0, help="размер входного фото, МБ")
+    parser.add_argument("--video-mb", type=float, default=20.0, help="размер результата, МБ")
+    parser.add_argument("--mode", choices=("before", "after"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run(args.mode, args.jobs, args.photo_mb, args.video_mb))))
+        return
+
+    print(f"jobs={args.jobs} photo={args.photo_mb} МБ video={args.video_mb} МБ")
+    print(f"{'mode':<7} {'peak RSS,MB':>12} {'per job,MB':>11}")
+    for r in asyncio.run(compare(args)):
+        print(f"{r['mode']:<7} {r['peak_mb']:>12.1f} {r['per_job_mb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
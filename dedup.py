@@ -0,0 +1,87 @@
+# dedup.py
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class Deduplicator:
+    """
+    Ограниченное по размеру и времени множество уже обработанных ключей.
+
+    `seen(key)` за O(1) отмечает ключ и сообщает, встречался ли он раньше в
+    пределах окна `window` секунд. Ключи хранятся в порядке добавления, поэтому
+    устаревшие записи вытесняются с начала без полного обхода.
+
+    При заданном `path` множество сохраняется в JSON-файл периодически и при
+    остановке и загружается при запуске, чтобы повторы не проходили и после перезапуска.
+    """
+    def __init__(self, name: str, window: float = 3600.0, max_size: int = 100_000, path: str | None = None):
+        self.name = name
+        self.window = window
+        self.max_size = max_size
+        self.path = path
+        self._seen: OrderedDict[Hashable, float] = OrderedDict()
+        self.suppressed = 0
+
+    def _evict(self, now: float):
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at <= self.window and len(self._seen) <= self.max_size:
+                break
+            self._seen.popitem(last=False)
+
+    def seen(self, key: Hashable) -> bool:
+        """Отмечает ключ. Возвращает True, если это повтор."""
+        now = time.time()
+        self._evict(now)
+        if key in self._seen:
+            self.suppressed += 1
+            return True
+        self._seen[key] = now
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    # --- Сохранение на диск ---
+
+    def _load_sync(self):
+        with open(self.path, encoding="utf-8") as f:
+            items = json.load(f)
+        for key, seen_at in items:
+            self._seen[tuple(key) if isinstance(key, list) else key] = seen_at
+        self._evict(time.time())
+
+    def _save_sync(self, items: list):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        os.replace(tmp_path, self.path)
+
+    async def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            await asyncio.to_thread(self._load_sync)
+            logger.info(f"Фильтр повторов '{self.name}' загружен: {len(self._seen)} ключей")
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Не удалось загрузить фильтр повторов '{self.name}' из {self.path}: {e}")
+
+    async def save(self):
+        logger.info(f"Фильтр повторов '{self.name}': отброшено повторов {self.suppressed}")
+        if not self.path:
+            return
+        # Снимок берется в цикле событий: seen() может менять словарь, пока поток пишет файл
+        items = list(self._seen.items())
+        try:
+            await asyncio.to_thread(self._save_sync, items)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить фильтр повторов '{self.name}' в {self.path}: {e}")
@@ -1,31 +1,111 @@
 # generator.py
+from __future__ import annotations
+
 import asyncio
 import logging
-from google import genai
-from google.genai.errors import APIError
+import time
 from aiogram.types import BufferedInputFile
 
+from metrics import IMAGE_GENERATE_SECONDS
+from prompt_cache import normalize_prompt
+from single_flight import SingleFlight
+from startup import LazyModule
+
+# SDK загружается при первом использовании, а не при импорте модуля
+genai = LazyModule("google.genai")
+genai_errors = LazyModule("google.genai.errors")
+
+# Imagen возвращает не больше 4 вариантов за один вызов
+MAX_IMAGES_PER_CALL = 4
+
 # Настройка логирования для отладки
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+
+class GeneratorBusyError(Exception):
+    """Свободный слот для вызова модели не освободился за допустимое время ожидания."""
+
+
 class GeminiGenerator:
     """
     Класс для взаимодействия с API Gemini для генерации контента.
     
-    Использует модель Imagen для создания изображений.
+    Использует модель Imagen для создания изображений. Несколько вариантов
+    запрашиваются одним вызовом (`number_of_images`), одновременные запросы с
+    одинаковым промптом объединяются в один вызов, а число одновременных
+    вызовов модели ограничено семафором. Слот ждем не дольше `max_wait`
+    секунд, после чего запрос отклоняется (GeneratorBusyError), а не копится
+    в очереди за семафором.
     """
-    def __init__(self, api_key: str):
-        # Инициализация клиента Google AI
-        self.client = genai.Client(api_key=api_key)
+    def __init__(self, api_key: str = None, client: genai.Client = None, image_model: str = None, max_concurrent: int = 2,
+                 max_wait: float = 30.0):
+        # Инициализация клиента Google AI (или использование общего клиента бота)
+        self.client = client or genai.Client(api_key=api_key)
         
         # Рекомендуемая модель для генерации изображений
         # NOTE: 'imagen-3.0-generate-002' может давать ошибку 404/NOT_FOUND 
         # из-за ограниченного доступа. Для стабильности вводим более старую, 
         # но общедоступную модель Imagen 2.1.
-        self.image_model = 'imagen-2.1-generate-002' 
+        self.image_model = image_model or 'imagen-2.1-generate-002' 
+        self.max_concurrent = max_concurrent
+        self._limiter = asyncio.Semaphore(max_concurrent)
+        self.max_wait = max_wait
+        self._flights = SingleFlight()
+        self.calls = 0
+        self.rejected = 0
         logger.info(f"Инициализирован генератор с моделью: {self.image_model}")
 
+    @property
+    def coalesced(self) -> int:
+        return self._flights.coalesced
+
+    async def _call_model(self, prompt: str, number_of_images: int, aspect_ratio: str) -> list[bytes]:
+        try:
+            await asyncio.wait_for(self._limiter.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise GeneratorBusyError(f"все слоты генерации ({self.max_concurrent}) заняты дольше {self.max_wait:.0f} с") from None
+        self.calls += 1
+        started = time.perf_counter()
+        try:
+            # Асинхронный интерфейс SDK (client.aio), чтобы запрос не блокировал цикл событий бота
+            result = await self.client.aio.models.generate_images(
+                model=self.image_model,
+                prompt=prompt,
+                config=dict(
+                    number_of_images=number_of_images,
+                    output_mime_type="image/jpeg",
+                    aspect_ratio=aspect_ratio,
+                )
+            )
+        finally:
+            IMAGE_GENERATE_SECONDS.observe(time.perf_counter() - started)
+            self._limiter.release()
+        return [generated.image.image_bytes for generated in (result.generated_images or []) if generated.image]
+
+    async def generate_images(self, prompt: str, number_of_images: int = 1, aspect_ratio: str = "1:1") -> list[bytes]:
+        """
+        Генерирует несколько вариантов изображения одним вызовом модели.
+
+        Если такой же запрос (промпт, число вариантов, соотношение сторон) уже
+        выполняется, результат этого вызова разделяется между всеми ожидающими.
+
+        :param prompt: Текстовое описание изображения.
+        :param number_of_images: Число вариантов (1-4).
+        :return: Байты изображений (может быть меньше запрошенного, если часть отфильтрована).
+        :raises APIError: при ошибке API.
+        :raises GeneratorBusyError: если слот для вызова модели не освободился за `max_wait` секунд.
+        """
+        number_of_images = max(1, min(MAX_IMAGES_PER_CALL, number_of_images))
+        key = (normalize_prompt(prompt), number_of_images, aspect_ratio)
+
+        async def call() -> list[bytes]:
+            logger.info(f"Запрос генерации изображений ({number_of_images} шт.): {prompt[:50]}...")
+            return await self._call_model(prompt, number_of_images, aspect_ratio)
+
+        return await self._flights.run(key, call)
+
 
     async def generate_image(self, prompt: str) -> BufferedInputFile | None:
         """
@@ -35,31 +115,20 @@ class GeminiGenerator:
         :return: Объект BufferedInputFile, готовый к отправке в Telegram, 
                  или None в случае ошибки.
         """
-        logger.info(f"Запрос генерации изображения: {prompt[:50]}...")
         try:
-            # Вызов генерации изображения через правильный метод API
-            result = self.client.models.generate_images(
-                model=self.image_model,
-                prompt=prompt,
-                config=dict(
-                    number_of_images=1,
-                    output_mime_type="image/png", 
-                    aspect_ratio="1:1"
-                )
-            )
+            images = await self.generate_images(prompt, number_of_images=1)
 
             # Проверка и обработка результата
-            if result.generated_images:
-                image_bytes = result.generated_images[0].image.image_bytes
+            if images:
                 logger.info("Изображение успешно сгенерировано.")
                 
                 # Создаем объект aiogram для отправки
-                return BufferedInputFile(image_bytes, filename="generated_image.png")
+                return BufferedInputFile(images[0], filename="generated_image.jpg")
             else:
                 logger.warning("Ошибка: Изображение не сгенерировано. Возможно, запрос был отклонен.")
                 return None
             
-        except APIError as e:
+        except genai_errors.APIError as e:
             logger.error(f"Ошибка API при генерации изображения: {e}")
             return None
         except Exception as e:
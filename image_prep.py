@@ -0,0 +1,136 @@
+# image_prep.py
+import asyncio
+import io
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from metrics import IMAGE_PREP_BYTES, IMAGE_PREP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Форматы, которые Pillow открывает и которые имеет смысл принимать от пользователя
+SUPPORTED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF", "MPO"}
+
+
+class ImageFormatError(ValueError):
+    """Файл не является изображением поддерживаемого формата."""
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    source_format: str
+    source_size: tuple[int, int]
+    size: tuple[int, int]
+
+
+def aspect_size(aspect_ratio: str, width: int) -> tuple[int, int]:
+    """Размер кадра по соотношению сторон вида "16:9" и ширине."""
+    w, h = (int(part) for part in aspect_ratio.split(":"))
+    return width, round(width * h / w)
+
+
+def prepare_image(data: bytes, target: tuple[int, int], quality: int = 88) -> PreparedImage:
+    """
+    Приводит фото к кадру Veo (синхронно, выполняется в отдельном процессе).
+
+    - настоящий формат определяется по содержимому, а не по расширению;
+    - ориентация из EXIF применяется к пикселям, сами метаданные не копируются;
+    - кадр обрезается по центру до соотношения сторон `target` и уменьшается до
+      него (без увеличения маленьких фото);
+    - результат перекодируется в JPEG с заданным качеством.
+    """
+    # Pillow нужен только в процессах пула, основной процесс его не импортирует
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        source_format = image.format
+        if source_format not in SUPPORTED_FORMATS:
+            raise ImageFormatError(f"Неподдерживаемый формат изображения: {source_format}")
+        source_size = image.size
+        # Для JPEG декодер сразу уменьшает изображение в 2-8 раз, если это не меньше цели
+        # (квадрат со стороной max(target) — чтобы хватило и после поворота по EXIF)
+        side = max(target)
+        image.draft("RGB", (side, side))
+        image.load()
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImageFormatError(str(e)) from e
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    target_w, target_h = target
+    scale = min(1.0, image.width / target_w, image.height / target_h)
+    size = (max(1, round(target_w * scale)), max(1, round(target_h * scale)))
+    image = ImageOps.fit(image, size, method=Image.Resampling.LANCZOS, centering=(0.5, 0.5))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return PreparedImage(buffer.getvalue(), "image/jpeg", source_format, source_size, size)
+
+
+def _warmup():
+    # Загружаем Pillow заранее, чтобы первое фото не платило за импорт
+    import PIL.Image  # noqa: F401
+    return True
+
+
+class ImagePreprocessor:
+    """
+    Подготовка фото к Veo в пуле процессов.
+
+    Декодирование, масштабирование и сжатие занимают десятки-сотни миллисекунд
+    CPU на фото, поэтому они выполняются в ProcessPoolExecutor и не задерживают
+    цикл событий (и не упираются в GIL вместе с остальным ботом).
+    """
+    def __init__(self, aspect_ratio: str = "16:9", width: int = 1280, quality: int = 88, workers: int = 2):
+        self.target = aspect_size(aspect_ratio, width)
+        self.quality = quality
+        self.workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def start(self):
+        """
+        Создает пул и сразу запускает процессы.
+
+        Вызывается в начале on_startup: при старте методом fork процессы лучше
+        создавать до потоков хранилищ и воркеров.
+        """
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _warmup) for _ in range(self.workers)))
+        logger.info(f"✅ Пул подготовки изображений запущен: {self.workers} процессов, кадр {self.target[0]}x{self.target[1]}.")
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def prepare(self, data: bytes) -> PreparedImage:
+        """
+        Готовит фото к отправке в Veo.
+
+        :raises ImageFormatError: если файл не удалось прочитать как изображение.
+        """
+        started = time.perf_counter()
+        prepared = await asyncio.get_running_loop().run_in_executor(
+            self._executor, prepare_image, data, self.target, self.quality
+        )
+        IMAGE_PREP_SECONDS.observe(time.perf_counter() - started)
+        IMAGE_PREP_BYTES.observe(len(data), stage="source")
+        IMAGE_PREP_BYTES.observe(len(prepared.data), stage="prepared")
+        logger.info(
+            f"Фото подготовлено: {prepared.source_format} {prepared.source_size[0]}x{prepared.source_size[1]}, "
+            f"{len(data) / 1024:.0f} КБ -> JPEG {prepared.size[0]}x{prepared.size[1]}, {len(prepared.data) / 1024:.0f} КБ"
+        )
+        return prepared
@@ -0,0 +1,149 @@
+# job_store.py
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Состояния задачи
+STATE_QUEUED = "queued"      # принята, ждет воркера
+STATE_RUNNING = "running"    # операция Veo запущена, ждем завершения
+STATE_DONE = "done"          # видео доставлено
+STATE_FAILED = "failed"      # ошибка, пользователь уведомлен
+
+UNFINISHED_STATES = (STATE_QUEUED, STATE_RUNNING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id            TEXT PRIMARY KEY,
+    chat_id           INTEGER NOT NULL,
+    user_id           INTEGER NOT NULL,
+    status_message_id INTEGER NOT NULL,
+    prompt            TEXT NOT NULL,
+    photo_file_id     TEXT,
+    force             INTEGER NOT NULL DEFAULT 0,
+    enhanced_prompt   TEXT,
+    operation_name    TEXT,
+    state             TEXT NOT NULL,
+    launched_at       REAL,
+    created_at        REAL NOT NULL,
+    updated_at        REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+
+class JobStore:
+    """
+    Долговременное хранилище задач генерации на SQLite.
+
+    Все обращения к базе идут через отдельный поток, чтобы не блокировать цикл
+    событий. Записи не коммитятся по одной: они копятся в памяти и сбрасываются
+    одной транзакцией раз в `flush_interval` секунд (журнал WAL), поэтому
+    вебхук почти ничего не платит за сохранение задачи. Записи, которые нельзя
+    потерять при падении процесса, вызывающий код сбрасывает сразу через `flush()`.
+
+    Для переживания редеплоев путь к базе должен указывать на постоянный диск.
+    """
+    def __init__(self, path: str = "jobs.db", flush_interval: float = 0.2, retention_days: float = 7.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        self._conn: sqlite3.Connection | None = None
+        self._pending: list[tuple[str, tuple]] = []
+        self._task: asyncio.Task | None = None
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open_sync(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        cutoff = time.time() - self.retention_days * 86400
+        conn.execute(
+            "DELETE FROM jobs WHERE state NOT IN (?, ?) AND updated_at < ?",
+            (*UNFINISHED_STATES, cutoff),
+        )
+        conn.commit()
+        self._conn = conn
+
+    async def open(self):
+        await self._call(self._open_sync)
+        self._task = asyncio.create_task(self._flush_loop(), name="job-store-flush")
+        logger.info(f"✅ Хранилище задач открыто: {self.path}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    # --- Запись (буферизованная) ---
+
+    def add(self, job_id: str, chat_id: int, user_id: int, status_message_id: int, prompt: str,
+            photo_file_id: str | None = None, force: bool = False):
+        now = time.time()
+        self._pending.append((
+            "INSERT OR REPLACE INTO jobs (job_id, chat_id, user_id, status_message_id, prompt, photo_file_id, force, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, chat_id, user_id, status_message_id, prompt, photo_file_id, int(force), STATE_QUEUED, now, now),
+        ))
+
+    def update(self, job_id: str, **fields):
+        """Обновляет поля задачи (state, enhanced_prompt, operation_name, launched_at, ...)."""
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._pending.append((f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id)))
+
+    def _write_sync(self, batch: list[tuple[str, tuple]]):
+        with self._conn:
+            for sql, params in batch:
+                self._conn.execute(sql, params)
+
+    async def flush(self):
+        if not self._pending or self._conn is None:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await self._call(self._write_sync, batch)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка записи в хранилище задач ({len(batch)} операций): {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # --- Чтение ---
+
+    def _unfinished_sync(self) -> list[dict]:
+        rows = self._conn.execute(
+            "SELECT * FROM jobs WHERE state IN (?, ?) ORDER BY created_at",
+            UNFINISHED_STATES,
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    async def unfinished(self) -> list[dict]:
+        """Возвращает задачи, которые не были завершены до остановки процесса."""
+        await self.flush()
+        return await self._call(self._unfinished_sync)
+
+    def _get_sync(self, job_id: str) -> dict | None:
+        row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    async def get(self, job_id: str) -> dict | None:
+        """Возвращает сохраненное состояние задачи (с учетом еще не сброшенных записей)."""
+        await self.flush()
+        return await self._call(self._get_sync, job_id)
@@ -0,0 +1,139 @@
+# jobs.py
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from scheduler import QueueFullError, RateLimitedError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VideoJob:
+    """
+    Задача генерации видео, поставленная в очередь обработчиком Telegram.
+
+    Содержит только то, что нужно воркеру: сами тяжелые шаги (улучшение промпта,
+    загрузка фото, запуск Veo и доставка) выполняются уже в пуле воркеров.
+    """
+    chat_id: int
+    user_id: int
+    prompt: str
+    status_message_id: int
+    photo_file_id: str | None = None
+    force: bool = False
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def is_image_mode(self) -> bool:
+        return self.photo_file_id is not None
+
+
+class JobQueue:
+    """
+    Очередь задач с фиксированным пулом асинхронных воркеров.
+
+    Вебхук только ставит задачу в очередь и сразу отвечает Telegram, а вся
+    долгая работа выполняется воркерами. Хранение задач, порядок выдачи, лимиты
+    и общую квоту определяет бэкенд очереди (см. queue_backend.py); при
+    переполнении `submit` выбрасывает QueueFullError (или RateLimitedError),
+    чтобы обработчик мог ответить пользователю.
+
+    Пока задача в работе, воркер продлевает ее аренду в бэкенде; если аренду
+    перехватил другой воркер, обработка здесь отменяется. При остановке
+    процесса задача возвращается в очередь, а не теряется.
+    """
+    def __init__(self, handler: Callable[[VideoJob], Awaitable[None]], backend, workers: int = 4,
+                 instance_id: str | None = None, heartbeat_interval: float = 20.0):
+        self.handler = handler
+        self.backend = backend
+        self.workers = workers
+        self.instance_id = instance_id or uuid.uuid4().hex[:8]
+        self.heartbeat_interval = heartbeat_interval
+        self._tasks: list[asyncio.Task] = []
+        self.in_progress = 0
+
+    def start(self):
+        """Запускает воркеры. Вызывается из on_startup, когда цикл событий уже работает."""
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i), name=f"video-worker-{i}"))
+        logger.info(f"✅ Пул воркеров {self.instance_id} запущен: {self.workers} воркеров, одновременно до "
+                    f"{self.backend.max_concurrent} задач, очередь до {self.backend.max_queued} задач.")
+
+    async def stop(self):
+        """Останавливает воркеры; незавершенные задачи возвращаются в очередь."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def is_full(self) -> bool:
+        return self.backend.is_full()
+
+    def check(self, user_id: int) -> int:
+        """Проверяет, примет ли бэкенд задачу пользователя, не занимая места."""
+        return self.backend.check(user_id)
+
+    async def submit(self, job: VideoJob, check_limits: bool = True) -> int:
+        """
+        Ставит задачу в очередь без ожидания ее выполнения.
+
+        :return: Позиция задачи в очереди (0 — начнется сразу).
+        :raises QueueFullError: если очередь заполнена.
+        :raises RateLimitedError: если пользователь превысил лимит запросов.
+        """
+        return await self.backend.submit(job, check_limits)
+
+    async def _heartbeat(self, job: VideoJob, worker_id: str, handler_task: asyncio.Task):
+        """Продлевает аренду; если ее перехватил другой воркер, отменяет обработку задачи здесь."""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                if not await self.backend.heartbeat(job, worker_id):
+                    logger.warning(f"Аренда задачи {job.job_id} потеряна воркером {worker_id}, обработка прерывается.")
+                    handler_task.cancel()
+                    return True
+            except Exception as e:
+                logger.warning(f"Не удалось продлить аренду задачи {job.job_id}: {e}")
+
+    async def _worker(self, index: int):
+        worker_id = f"{self.instance_id}-{index}"
+        while True:
+            try:
+                job = await self.backend.lease(worker_id)
+            except Exception as e:
+                logger.error(f"❌ Воркер {worker_id} не смог получить задачу из очереди: {e}")
+                await asyncio.sleep(1)
+                continue
+            self.in_progress += 1
+            # Обработчик — отдельная задача: при потере аренды ее отменяет _heartbeat,
+            # чтобы задача не выполнялась одновременно двумя воркерами
+            handler_task = asyncio.create_task(self.handler(job))
+            heartbeat = asyncio.create_task(self._heartbeat(job, worker_id, handler_task))
+            try:
+                await handler_task
+            except asyncio.CancelledError:
+                if heartbeat.done() and not heartbeat.cancelled() and heartbeat.result():
+                    # Задачей уже владеет другой воркер: не завершаем и не возвращаем ее
+                    continue
+                if asyncio.current_task().cancelling():
+                    # Останавливают сам воркер: задача возвращается в очередь
+                    handler_task.cancel()
+                    await asyncio.gather(handler_task, return_exceptions=True)
+                    await asyncio.shield(self.backend.abandon(job, worker_id))
+                    raise
+                # CancelledError пришла изнутри обработчика, воркер продолжает работу
+                logger.error(f"Обработка задачи {job.job_id} в воркере {worker_id} прервана отменой внутри обработчика.")
+                await self.backend.complete(job, worker_id)
+            except Exception as e:
+                logger.error(f"Необработанная ошибка в воркере {worker_id} (чат {job.chat_id}): {e}", exc_info=True)
+                await self.backend.complete(job, worker_id)
+            else:
+                await self.backend.complete(job, worker_id)
+            finally:
+                self.in_progress -= 1
+                heartbeat.cancel()
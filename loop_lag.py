@@ -0,0 +1,58 @@
+# loop_lag.py
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """
+    Измеряет задержку цикла событий asyncio.
+
+    Раз в `interval` секунд засыпает и сравнивает фактическое время пробуждения
+    с ожидаемым. Любой синхронный вызов внутри корутины (например, блокирующий
+    запрос к SDK) проявляется как рост задержки.
+    """
+    def __init__(self, interval: float = 0.1, warn_threshold: float = 0.5):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.samples: list[float] = []
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def reset(self):
+        self.samples.clear()
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def percentile(self, q: float) -> float:
+        """Возвращает перцентиль задержки (q от 0 до 100) по накопленным замерам."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.samples.append(lag)
+            if len(self.samples) > 10_000:
+                del self.samples[:5_000]
+            if lag > self.warn_threshold:
+                logger.warning(f"⚠️ Цикл событий заблокирован на {lag * 1000:.0f} мс")
@@ -0,0 +1,200 @@
+# lro_poller.py
+import asyncio
+import heapq
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _TrackedOperation:
+    operation: Any
+    started_at: float
+    future: asyncio.Future
+    polls: int = 0
+    errors: int = 0
+    overdue_polls: int = 0
+    first_poll_at: float | None = None
+    on_first_poll: list[Callable[[float], None]] = field(default_factory=list)
+
+
+class OperationTracker:
+    """
+    Единый опросчик долгих операций (LRO) Veo.
+
+    Вместо отдельного цикла `while not operation.done` в каждой задаче все
+    операции живут в одной очереди по времени следующего опроса. Расписание
+    адаптивное: первый опрос — примерно на середине ожидаемого времени,
+    затем частые опросы около ожидаемого завершения и экспоненциальное
+    замедление для затянувшихся операций. К интервалам добавляется джиттер,
+    а общее число опросов ограничено глобальным бюджетом (опросов в секунду).
+
+    :param poll: Корутина, получающая актуальное состояние операции
+                 (например, `client.aio.operations.get`).
+    """
+    def __init__(
+        self,
+        poll: Callable[[Any], Awaitable[Any]],
+        expected_duration: float = 60.0,
+        min_interval: float = 2.0,
+        max_interval: float = 30.0,
+        polls_per_second: float = 5.0,
+        jitter: float = 0.2,
+        timeout: float = 900.0,
+        max_errors: int = 5,
+    ):
+        self.poll = poll
+        self.expected_duration = expected_duration
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.max_errors = max_errors
+        self.budget = TokenBucket(polls_per_second)
+
+        self._tracked: dict[str, _TrackedOperation] = {}
+        self._schedule: list[tuple[float, int, str]] = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._poll_tasks: set[asyncio.Task] = set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="lro-poller")
+        logger.info(f"✅ Опросчик LRO запущен (бюджет {self.budget.rate} опросов/с).")
+
+    async def stop(self):
+        tasks = [t for t in (self._task, *self._poll_tasks) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tracked)
+
+    def track(self, operation, started_at: float | None = None) -> asyncio.Future:
+        """
+        Берет операцию под наблюдение и возвращает future с завершенной операцией.
+
+        Повторный вызов для той же операции возвращает тот же future, так что
+        результат получают все ожидающие.
+        """
+        name = operation.name
+        tracked = self._tracked.get(name)
+        if tracked is None:
+            started_at = time.monotonic() if started_at is None else started_at
+            tracked = _TrackedOperation(operation, started_at, asyncio.get_running_loop().create_future())
+            self._tracked[name] = tracked
+            self._schedule_poll(name, self._next_interval(tracked))
+        return tracked.future
+
+    async def wait(self, operation, started_at: float | None = None, on_first_poll: Callable[[float], None] | None = None):
+        """
+        Ждет завершения операции.
+
+        :param started_at: Момент запуска по time.monotonic() (для уже идущих операций).
+        :param on_first_poll: Вызывается с задержкой до первого опроса в секундах.
+        """
+        future = self.track(operation, started_at)
+        if on_first_poll is not None:
+            self._tracked[operation.name].on_first_poll.append(on_first_poll)
+        return await asyncio.shield(future)
+
+    def _next_interval(self, tracked: _TrackedOperation) -> float:
+        elapsed = time.monotonic() - tracked.started_at
+        half = self.expected_duration * 0.5
+        if elapsed < half:
+            # Рано: спим почти до середины ожидаемого времени
+            interval = half - elapsed
+        elif elapsed < self.expected_duration * 1.5:
+            # Около ожидаемого завершения опрашиваем чаще всего
+            interval = self.min_interval
+        else:
+            # Затянувшаяся операция: экспоненциально замедляемся
+            tracked.overdue_polls += 1
+            interval = self.min_interval * (1.5 ** tracked.overdue_polls)
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _schedule_poll(self, name: str, delay: float):
+        self._seq += 1
+        heapq.heappush(self._schedule, (time.monotonic() + delay, self._seq, name))
+        self._wakeup.set()
+
+    def _finish(self, name: str, result=None, error: BaseException | None = None):
+        tracked = self._tracked.pop(name, None)
+        if tracked is None or tracked.future.done():
+            return
+        if error is not None:
+            tracked.future.set_exception(error)
+        else:
+            tracked.future.set_result(result)
+
+    async def _run(self):
+        while True:
+            if not self._schedule:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            due, _, name = self._schedule[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._schedule)
+            if name not in self._tracked:
+                continue
+            await self.budget.acquire()
+            task = asyncio.create_task(self._poll_one(name))
+            self._poll_tasks.add(task)
+            task.add_done_callback(self._poll_tasks.discard)
+
+    async def _poll_one(self, name: str):
+        tracked = self._tracked.get(name)
+        if tracked is None:
+            return
+
+        if tracked.first_poll_at is None:
+            tracked.first_poll_at = time.monotonic()
+            for callback in tracked.on_first_poll:
+                callback(tracked.first_poll_at - tracked.started_at)
+
+        try:
+            operation = await self.poll(tracked.operation)
+        except Exception as e:
+            tracked.errors += 1
+            logger.warning(f"Ошибка опроса LRO {name} ({tracked.errors}/{self.max_errors}): {e}")
+            if tracked.errors >= self.max_errors:
+                self._finish(name, error=e)
+            else:
+                self._schedule_poll(name, self.min_interval * (2 ** tracked.errors))
+            return
+
+        tracked.operation = operation
+        tracked.polls += 1
+        tracked.errors = 0
+
+        if operation.done:
+            elapsed = time.monotonic() - tracked.started_at
+            logger.info(f"Операция {name} завершена за {elapsed:.0f} с ({tracked.polls} опросов).")
+            self._finish(name, result=operation)
+        elif time.monotonic() - tracked.started_at > self.timeout:
+            self._finish(name, error=TimeoutError(f"Операция {name} не завершилась за {self.timeout:.0f} с"))
+        else:
+            state = getattr(getattr(operation, "metadata", None), "state", None)
+            logger.info(f"Статус LRO {name}: {getattr(state, 'name', state)}")
+            self._schedule_poll(name, self._next_interval(tracked))
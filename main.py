@@ -1,21 +1,50 @@
+# Аннотации не вычисляются при импорте: типы genai загружаются лениво
+from __future__ import annotations
+
+import time
+
+# Отсчет времени запуска — до импорта остальных модулей
+PROCESS_STARTED = time.perf_counter()
+
 import asyncio
 import logging
 import os
-import io
-import base64
+import signal
+import hashlib
+import json
+
+from jobs import JobQueue, QueueFullError, RateLimitedError, VideoJob
+from scheduler import FairScheduler
+from queue_backend import InProcessQueueBackend, SqliteQueueBackend
+from loop_lag import LoopLagMonitor
+from lro_poller import OperationTracker
+from prompt_cache import PromptCache
+from prompt_batcher import BatchParseError, PromptBatcher
+from result_cache import ResultCache, make_result_key
+from dedup import Deduplicator
+from telegram_sender import PRIORITY_FINAL, TelegramSender
+from generator import GeminiGenerator, GeneratorBusyError
+from image_prep import ImageFormatError, ImagePreprocessor
+from media import close_session, download_telegram_file, input_file_size, video_input_file
+from metrics import (
+    ENHANCE_PROMPT_SECONDS, ERRORS_TOTAL, FEED_UPDATE_SECONDS, REGISTRY, STARTUP_SECONDS, TELEGRAM_UPLOAD_BYTES,
+    TELEGRAM_UPLOAD_SECONDS, VEO_FIRST_POLL_SECONDS, VEO_LRO_SECONDS, metrics_handler,
+)
+from job_store import JobStore, STATE_DONE, STATE_FAILED, STATE_QUEUED, STATE_RUNNING
 
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.types import BufferedInputFile
 from aiogram.filters.command import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from aiohttp import web
 
-# --- ВНИМАНИЕ: PIL (Pillow) нужна для aiogram/фото, но не используется напрямую в этом фрагменте ---
-#from PIL import Image 
-# Если вы видите ошибку "NameError: name 'Image' is not defined", раскомментируйте строку выше.
+from startup import LazyModule, LazyObject, StartupTimer
 
-from google import genai
-from google.genai import types
-from google.genai.errors import APIError
+# google-genai импортируется при первом обращении (или в фоне после запуска), а не при старте процесса
+genai = LazyModule("google.genai")
+genai_types = LazyModule("google.genai.types")
+genai_errors = LazyModule("google.genai.errors")
 
 # --- Настройка логирования ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -30,12 +59,82 @@ WEBHOOK_SECRET = os.getenv("TG_WEBHOOK_SECRET", "default-secret-path")
 WEBHOOK_PATH = f"/webhook/{WEBHOOK_SECRET}"
 # WEBHOOK_URL будет собран после проверки WEBHOOK_HOST
 
+# Альтернативные адреса API (локальный Bot API сервер, заглушки нагрузочного теста)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # пусто — https://api.telegram.org
+GEMINI_API_URL = os.getenv("GEMINI_API_URL")      # пусто — адрес Gemini API по умолчанию
+
+# Быстрый запуск: SDK Gemini загружается в фоне после старта веб-сервера
+FAST_START = os.getenv("FAST_START", "1") == "1"
+# Снимать вебхук при остановке (при масштабировании до нуля вебхук должен оставаться)
+WEBHOOK_DELETE_ON_SHUTDOWN = os.getenv("WEBHOOK_DELETE_ON_SHUTDOWN", "0") == "1"
+
 WEB_SERVER_HOST = '0.0.0.0'
 WEB_SERVER_PORT = int(os.getenv("PORT", 8080))
 
+# --- Пул воркеров генерации ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 100))
+
+# --- Лимиты исходящих запросов к Telegram ---
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", 25))      # сообщений в секунду на бота
+TG_PER_CHAT_RATE = float(os.getenv("TG_PER_CHAT_RATE", 1))   # сообщений в секунду на чат
+
+# --- Справедливое распределение квоты Veo между пользователями ---
+VEO_MAX_CONCURRENT = int(os.getenv("VEO_MAX_CONCURRENT", JOB_WORKERS))  # общая квота одновременных генераций
+USER_MAX_IN_FLIGHT = int(os.getenv("USER_MAX_IN_FLIGHT", 1))
+USER_MAX_QUEUED = int(os.getenv("USER_MAX_QUEUED", 5))
+USER_REQUESTS_PER_HOUR = float(os.getenv("USER_REQUESTS_PER_HOUR", 20))
+USER_REQUESTS_BURST = float(os.getenv("USER_REQUESTS_BURST", 3))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+
+# --- Масштабирование: роль процесса и общая очередь задач ---
+BOT_ROLE = os.getenv("BOT_ROLE", "all")  # all | web (только прием вебхуков) | worker (только генерация)
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "inprocess" if BOT_ROLE == "all" else "sqlite")  # inprocess | sqlite
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", JOB_DB_PATH)
+QUEUE_LEASE_TTL = float(os.getenv("QUEUE_LEASE_TTL", 60))
+# --- Защита от повторной доставки обновлений ---
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", 3600))
+DEDUP_UPDATES_PATH = os.getenv("DEDUP_UPDATES_PATH")    # пусто — только в памяти
+DEDUP_MESSAGES_PATH = os.getenv("DEDUP_MESSAGES_PATH")  # пусто — только в памяти
+
+QUEUE_FULL_TEXT = "⏳ **Сервис перегружен:** очередь генерации заполнена. Пожалуйста, попробуйте позже."
+RATE_LIMITED_TEXT = "⏳ **Слишком много запросов.** Следующее видео можно заказать через {retry_after} с."
+IMAGE_RATE_LIMITED_TEXT = "⏳ **Слишком много запросов.** Следующую генерацию можно заказать через {retry_after} с."
+IMAGE_BUSY_TEXT = "⏳ **Генерация изображений сейчас перегружена.** Пожалуйста, попробуйте позже."
+
 # --- Настройка моделей Gemini/Veo ---
 TEXT_MODEL = "gemini-2.5-flash-preview-09-2025"
 VEO_MODEL = "veo-3.1-generate-preview"
+VIDEO_ASPECT_RATIO = "16:9"
+
+# --- Кэш готовых видео (Telegram file_id) ---
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 5000))
+RESULT_CACHE_POLICY = os.getenv("RESULT_CACHE_POLICY", "lru")  # lru | fifo
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL")) if os.getenv("RESULT_CACHE_TTL") else None
+
+# --- Кэш улучшенных промптов ---
+ENHANCE_CACHE_SIZE = int(os.getenv("ENHANCE_CACHE_SIZE", 1000))
+ENHANCE_CACHE_TTL = float(os.getenv("ENHANCE_CACHE_TTL", 24 * 3600))
+ENHANCE_CACHE_PATH = os.getenv("ENHANCE_CACHE_PATH")  # пусто — только в памяти
+PERSIST_INTERVAL_SECONDS = float(os.getenv("PERSIST_INTERVAL_SECONDS", 300))  # период сохранения кэшей на диск
+ENHANCE_BATCH_WINDOW_MS = float(os.getenv("ENHANCE_BATCH_WINDOW_MS", 100))  # окно сбора пакета
+ENHANCE_BATCH_SIZE = int(os.getenv("ENHANCE_BATCH_SIZE", 16))              # 1 — без пакетирования
+
+# --- Генерация изображений (/image) ---
+IMAGE_MODEL = os.getenv("IMAGE_MODEL", "imagen-4.0-generate-001")
+IMAGE_ASPECT_RATIO = os.getenv("IMAGE_ASPECT_RATIO", "1:1")
+IMAGE_MAX_VARIANTS = int(os.getenv("IMAGE_MAX_VARIANTS", 4))      # не больше 4 за вызов Imagen
+IMAGE_MAX_CONCURRENT = int(os.getenv("IMAGE_MAX_CONCURRENT", 2))  # одновременных вызовов Imagen
+IMAGE_MAX_WAIT_SECONDS = float(os.getenv("IMAGE_MAX_WAIT_SECONDS", 30))  # дольше ждать слот — "попробуйте позже"
+
+# --- Подготовка фото для Veo (пул процессов) ---
+IMAGE_TARGET_WIDTH = int(os.getenv("IMAGE_TARGET_WIDTH", 1280))   # высота — по VIDEO_ASPECT_RATIO
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 88))
+IMAGE_PREP_WORKERS = int(os.getenv("IMAGE_PREP_WORKERS", 2))
+
+# --- Опрос LRO Veo ---
+VEO_EXPECTED_SECONDS = float(os.getenv("VEO_EXPECTED_SECONDS", 60))
+VEO_POLLS_PER_SECOND = float(os.getenv("VEO_POLLS_PER_SECOND", 5))
 
 
 # --- Диагностика переменных перед запуском ---
@@ -43,6 +142,7 @@ logger.info("--- Проверка переменных окружения ---")
 logger.info(f"TELEGRAM_BOT_TOKEN: {'✅ Установлен' if TELEGRAM_BOT_TOKEN else '❌ НЕ УСТАНОВЛЕН'}")
 logger.info(f"GEMINI_API_KEY: {'✅ Установлен' if GEMINI_API_KEY else '❌ НЕ УСТАНОВЛЕН'}")
 logger.info(f"WEBHOOK_HOST: {WEBHOOK_HOST if WEBHOOK_HOST else '❌ НЕ УСТАНОВЛЕН'}")
+logger.info(f"BOT_ROLE: {BOT_ROLE}, QUEUE_BACKEND: {QUEUE_BACKEND}")
 logger.info("-------------------------------------")
 
 if not TELEGRAM_BOT_TOKEN or not GEMINI_API_KEY or not WEBHOOK_HOST:
@@ -60,127 +160,372 @@ WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 
 
 # --- Инициализация клиентов ---
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=TELEGRAM_BOT_TOKEN, session=bot_session)
 dp = Dispatcher()
-try:
-    gemini_client = genai.Client(api_key=GEMINI_API_KEY)
-    logger.info("✅ Генератор Gemini инициализирован.")
-except Exception as e:
-    logger.error(f"❌ Ошибка инициализации Gemini клиента: {e}")
-    exit()
+telegram_sender = TelegramSender(bot, global_rate=TG_GLOBAL_RATE, per_chat_rate=TG_PER_CHAT_RATE)
+
+
+def build_gemini_client():
+    """Создает клиент Gemini (в потоке из gemini_ready, до первого обращения к gemini_client)."""
+    started = time.perf_counter()
+    gemini_http_options = genai_types.HttpOptions(base_url=GEMINI_API_URL) if GEMINI_API_URL else None
+    client = genai.Client(api_key=GEMINI_API_KEY, http_options=gemini_http_options)
+    logger.info(f"✅ Клиент Gemini инициализирован за {(time.perf_counter() - started) * 1000:.0f} мс.")
+    return client
+
+
+gemini_client = LazyObject(build_gemini_client)
+# Общая загрузка SDK и клиента в потоках (см. gemini_ready)
+gemini_loading: asyncio.Task | None = None
+
+
+# Долговременное хранилище задач (переживает перезапуски и редеплои)
+job_store = JobStore(JOB_DB_PATH)
+
+# Кэш улучшенных промптов с объединением одинаковых одновременных запросов
+prompt_cache = PromptCache(max_size=ENHANCE_CACHE_SIZE, ttl=ENHANCE_CACHE_TTL, path=ENHANCE_CACHE_PATH)
+
+# Кэш готовых видео: повторный запрос отвечается пересылкой file_id
+result_cache = ResultCache(JOB_DB_PATH, max_entries=RESULT_CACHE_SIZE, policy=RESULT_CACHE_POLICY, ttl=RESULT_CACHE_TTL)
 
+# Повторно доставленные Telegram обновления (update_id) и сообщения (chat_id, message_id)
+update_deduplicator = Deduplicator("update_id", window=DEDUP_WINDOW_SECONDS, path=DEDUP_UPDATES_PATH)
+message_deduplicator = Deduplicator("chat_id/message_id", window=DEDUP_WINDOW_SECONDS, path=DEDUP_MESSAGES_PATH)
+
+# Единый опросчик всех операций Veo
+operation_tracker = OperationTracker(
+    poll=lambda operation: gemini_client.aio.operations.get(operation),
+    expected_duration=VEO_EXPECTED_SECONDS,
+    polls_per_second=VEO_POLLS_PER_SECOND,
+)
+
+# Генератор изображений Imagen: варианты одним вызовом, объединение одинаковых запросов
+image_generator = GeminiGenerator(client=gemini_client, image_model=IMAGE_MODEL, max_concurrent=IMAGE_MAX_CONCURRENT,
+                                  max_wait=IMAGE_MAX_WAIT_SECONDS)
+
+# Подготовка фото к кадру Veo вне цикла событий
+image_preprocessor = ImagePreprocessor(
+    aspect_ratio=VIDEO_ASPECT_RATIO, width=IMAGE_TARGET_WIDTH, quality=IMAGE_JPEG_QUALITY, workers=IMAGE_PREP_WORKERS,
+)
+
+# Монитор задержки цикла событий: предупреждает, если что-то блокирует loop
+loop_lag_monitor = LoopLagMonitor()
+
+
+# --- Вспомогательные функции ---
+
+async def send_text(chat_id: int, text: str, **kwargs):
+    """Отправляет сообщение через диспетчер исходящих запросов (с учетом лимитов Telegram)."""
+    return await telegram_sender.send(lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), chat_id, PRIORITY_FINAL)
+
+
+async def reply(message: types.Message, text: str, **kwargs):
+    """Отвечает на сообщение пользователя через диспетчер исходящих запросов."""
+    return await telegram_sender.send(lambda: message.answer(text, **kwargs), message.chat.id, PRIORITY_FINAL)
+
+
+ENHANCE_ROLE_INSTRUCTION = (
+    "Ты — креативный директор по цифровому искусству. Твоя задача — "
+    "превратить короткий, простой запрос пользователя (промпт) в детальное, "
+    "высококачественное описание движения, стиля и атмосферы для генерации видео. "
+)
+ENHANCE_SYSTEM_INSTRUCTION = ENHANCE_ROLE_INSTRUCTION + "Отвечай ТОЛЬКО улучшенным промптом, без лишних слов."
+ENHANCE_BATCH_SYSTEM_INSTRUCTION = ENHANCE_ROLE_INSTRUCTION + (
+    "На вход подается JSON-массив промптов разных пользователей; улучши каждый независимо от остальных. "
+    "Отвечай ТОЛЬКО JSON-массивом строк той же длины и в том же порядке, без лишних слов."
+)
+
+
+async def generate_enhanced_prompt(prompt: str) -> str:
+    """Один вызов модели для улучшения промпта (без кэша и обработки ошибок)."""
+    # Асинхронный интерфейс SDK (client.aio), чтобы не блокировать цикл событий
+    response = await gemini_client.aio.models.generate_content(
+        model=TEXT_MODEL,
+        contents=[prompt],
+        config=genai_types.GenerateContentConfig(system_instruction=ENHANCE_SYSTEM_INSTRUCTION),
+    )
+    enhanced_prompt = response.text.strip().replace('"', '')
+    logger.info(f"Улучшенный промпт: {enhanced_prompt}")
+    return enhanced_prompt
+
+
+async def generate_enhanced_prompts(prompts: list[str]) -> list:
+    """Один вызов модели для пакета промптов: на входе и на выходе JSON-массив."""
+    response = await gemini_client.aio.models.generate_content(
+        model=TEXT_MODEL,
+        contents=[json.dumps(prompts, ensure_ascii=False)],
+        config=genai_types.GenerateContentConfig(
+            system_instruction=ENHANCE_BATCH_SYSTEM_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=list[str],
+        ),
+    )
+    try:
+        results = json.loads(response.text)
+    except (TypeError, ValueError) as e:
+        raise BatchParseError(str(e)) from e
+    if not isinstance(results, list):
+        raise BatchParseError("ответ не является JSON-массивом")
+    logger.info(f"Улучшено промптов одним запросом: {len(prompts)}")
+    # Некорректные элементы (не строки) батчер улучшит по одному
+    return [item.strip().replace('"', '') if isinstance(item, str) else None for item in results]
+
+
+# Пакетирование улучшения промптов: одновременные запросы уходят к модели одним вызовом
+prompt_batcher = PromptBatcher(
+    generate_enhanced_prompt,
+    generate_enhanced_prompts,
+    window=ENHANCE_BATCH_WINDOW_MS / 1000,
+    max_batch=ENHANCE_BATCH_SIZE,
+)
 
-# --- Вспомогательные функции (оставлены без изменений) ---
 
 async def enhance_prompt(prompt: str) -> str:
     """Улучшает короткий пользовательский промпт, добавляя детали для лучшей генерации видео."""
-    system_instruction = (
-        "Ты — креативный директор по цифровому искусству. Твоя задача — "
-        "превратить короткий, простой запрос пользователя (промпт) в детальное, "
-        "высококачественное описание движения, стиля и атмосферы для генерации видео. "
-        "Отвечай ТОЛЬКО улучшенным промптом, без лишних слов."
-    )
-    
     try:
-        response = gemini_client.models.generate_content(
-            model=TEXT_MODEL,
-            contents=[prompt],
-            system_instruction=types.SystemInstruction(parts=[types.Part.from_text(system_instruction)]),
-        )
-        enhanced_prompt = response.text.strip().replace('"', '')
-        logger.info(f"Улучшенный промпт: {enhanced_prompt}")
-        return enhanced_prompt
-    except APIError as e:
+        with ENHANCE_PROMPT_SECONDS.time():
+            return await prompt_cache.get_or_compute(TEXT_MODEL, prompt, prompt_batcher.enhance)
+    except genai_errors.APIError as e:
+        ERRORS_TOTAL.inc(stage="enhance", type=type(e).__name__)
         logger.error(f"Ошибка API при улучшении промпта: {e}")
         return prompt # Возвращаем оригинальный промпт в случае ошибки
 
 
 # --- Рабочий процесс Veo (Фоновая задача) ---
 
-async def veo_video_worker(chat_id: int, enhanced_prompt: str, status_message: types.Message, image_input_data: dict = None):
+def image_caption(prompt: str) -> str:
+    # Подпись медиагруппы ограничена 1024 символами. Обратную кавычку внутри `...`
+    # в Markdown не экранировать: с ней Telegram не разберет подпись уже после оплаченного вызова
+    prompt = prompt[:900].replace("`", "'")
+    return f"🎨 **Готово!** Изображения по запросу:\n`{prompt}`"
+
+
+async def send_images(chat_id: int, images: list[bytes], caption: str):
+    """Отправляет одно фото или медиагруппу (подпись — у первого элемента)."""
+    files = [types.BufferedInputFile(data, filename=f"image_{i + 1}.jpg") for i, data in enumerate(images)]
+    TELEGRAM_UPLOAD_BYTES.observe(sum(len(data) for data in images))
+
+    async def upload():
+        with TELEGRAM_UPLOAD_SECONDS.time():
+            if len(files) == 1:
+                return await bot.send_photo(chat_id=chat_id, photo=files[0], caption=caption, parse_mode="Markdown")
+            media = [
+                types.InputMediaPhoto(media=file, caption=caption if i == 0 else None, parse_mode="Markdown")
+                for i, file in enumerate(files)
+            ]
+            return await bot.send_media_group(chat_id=chat_id, media=media)
+
+    return await telegram_sender.send(upload, chat_id, PRIORITY_FINAL)
+
+
+def video_caption(enhanced_prompt: str) -> str:
+    return (f"🎥 **Готово!** Видео сгенерировано с помощью Veo 3.1.\n\n"
+            f"_Использованный промпт:_\n`{enhanced_prompt}`")
+
+
+async def send_cached_video(chat_id: int, enhanced_prompt: str, result_key: str) -> bool:
+    """Отправляет ранее сгенерированное видео по file_id. Возвращает False при промахе кэша."""
+    file_id = await result_cache.get(result_key)
+    if file_id is None:
+        return False
+    try:
+        await telegram_sender.send(
+            lambda: bot.send_video(chat_id=chat_id, video=file_id, caption=video_caption(enhanced_prompt), parse_mode="Markdown"),
+            chat_id,
+        )
+    except TelegramBadRequest as e:
+        logger.warning(f"file_id из кэша больше не принимается Telegram, генерируем заново: {e}")
+        await result_cache.invalidate(result_key)
+        return False
+    logger.info(f"Видео отдано из кэша результатов (ключ {result_key[:12]}).")
+    return True
+
+
+async def veo_video_worker(job_id: str, chat_id: int, enhanced_prompt: str, status_message_id: int, image_input_data: genai_types.Image = None,
+                           operation=None, started_at: float = None, result_key: str = None, force: bool = False):
     """
     Универсальная фоновая задача для обработки LRO генерации видео Veo.
-    Принимает опциональные Base64-данные изображения (если это режим 'Изображение в Видео').
+    Принимает опциональное входное изображение (если это режим 'Изображение в Видео').
+    Если передана уже запущенная операция (восстановление после перезапуска),
+    шаг запуска пропускается и задача сразу ждет ее завершения.
+    Если для `result_key` уже есть готовое видео, оно пересылается без запуска
+    Veo (кроме принудительной перегенерации `force`).
     """
     is_image_mode = image_input_data is not None
     total_steps = 3 if is_image_mode else 2
+    finished = False
     
     try:
-        # 1. Запуск генерации видео
-        
-        generate_args = {
-            "model": VEO_MODEL,
-            "prompt": enhanced_prompt,
-            "config": types.GenerateVideosConfig(aspect_ratio="16:9") # Задаем соотношение сторон
-        }
-        
-        if is_image_mode:
-            generate_args["image"] = image_input_data
-            step_number = 2
-        else:
-            step_number = 1
-            
-        await bot.edit_message_text(
-            chat_id=chat_id, 
-            message_id=status_message.message_id, 
-            text=f"🤖 {step_number}/{total_steps}: Запускаю генерацию видео с {VEO_MODEL}. Ожидайте уведомления (может занять 1-5 минут)..."
-        )
-        
-        operation = gemini_client.models.generate_videos(**generate_args)
-        operation_name = operation.name
-        
-        logger.info(f"Операция Veo LRO запущена: {operation_name}")
+        if operation is None and result_key and not force:
+            if await send_cached_video(chat_id, enhanced_prompt, result_key):
+                job_store.update(job_id, state=STATE_DONE)
+                finished = True
+                return
+
+        # Время до первого опроса имеет смысл только для только что запущенной операции:
+        # у восстановленной оно включало бы простой на время перезапуска
+        on_first_poll = None
+        if operation is None:
+            operation = await launch_veo_operation(job_id, chat_id, enhanced_prompt, status_message_id, image_input_data, total_steps)
+            on_first_poll = VEO_FIRST_POLL_SECONDS.observe
+        if started_at is None:
+            started_at = time.monotonic()
 
-        # 2. Опрос LRO до завершения
-        while not operation.done:
-            await asyncio.sleep(10) # Опрос каждые 10 секунд
-            operation = gemini_client.operations.get(operation_name)
-            logger.info(f"Статус LRO {operation_name}: {operation.metadata.state.name}")
+        # 2. Ожидание завершения через общий опросчик LRO
+        operation = await operation_tracker.wait(operation, started_at=started_at, on_first_poll=on_first_poll)
+        VEO_LRO_SECONDS.observe(time.monotonic() - started_at)
         
         # 3. Обработка и отправка результата
-        video_part = operation.response.generated_videos[0].video.inline_data
-
-        if video_part and video_part.data:
-            video_bytes = base64.b64decode(video_part.data)
-            
-            await bot.send_video(
-                chat_id=chat_id,
-                video=BufferedInputFile(video_bytes, filename="generated_video.mp4"),
-                caption=f"🎥 **Готово!** Видео сгенерировано с помощью Veo 3.1.\n\n"
-                        f"_Использованный промпт:_\n`{enhanced_prompt}`",
-                parse_mode="Markdown"
-            )
+        response = operation.response
+        video = response.generated_videos[0].video if response and response.generated_videos else None
+
+        if video is not None:
+            # Без base64 и лишних копий: крупные файлы идут через временный файл на диске
+            async with video_input_file(video, GEMINI_API_KEY) as video_file:
+                TELEGRAM_UPLOAD_BYTES.observe(input_file_size(video_file))
+
+                async def upload_video():
+                    # Замеряем только сам вызов Bot API, без ожидания в очереди отправки
+                    with TELEGRAM_UPLOAD_SECONDS.time():
+                        return await bot.send_video(
+                            chat_id=chat_id,
+                            video=video_file,
+                            caption=video_caption(enhanced_prompt),
+                            parse_mode="Markdown"
+                        )
+
+                sent_message = await telegram_sender.send(upload_video, chat_id)
+            job_store.update(job_id, state=STATE_DONE)
+            if result_key and sent_message.video:
+                await result_cache.put(result_key, sent_message.video.file_id)
         else:
-             await bot.send_message(
+             job_store.update(job_id, state=STATE_FAILED)
+             await send_text(
                 chat_id=chat_id, 
                 text="❌ **Ошибка генерации видео:** Не удалось получить данные видео из ответа Veo."
             )
+        finished = True
 
-    except APIError as e:
+    except genai_errors.APIError as e:
+        finished = True
+        job_store.update(job_id, state=STATE_FAILED)
+        ERRORS_TOTAL.inc(stage="veo", type=type(e).__name__)
         logger.error(f"Ошибка API Gemini/Veo в воркере: {e}")
-        await bot.send_message(
+        await send_text(
             chat_id=chat_id, 
             text=f"❌ **Ошибка API при генерации видео:** Произошла ошибка связи с сервисом. Детали: `{e}`"
         )
     except Exception as e:
+        finished = True
+        job_store.update(job_id, state=STATE_FAILED)
+        ERRORS_TOTAL.inc(stage="veo", type=type(e).__name__)
         logger.error(f"Неизвестная ошибка в воркере Veo: {e}", exc_info=True)
-        await bot.send_message(
+        await send_text(
             chat_id=chat_id, 
             text=f"❌ **Критическая ошибка:** Что-то пошло не так при обработке запроса видео: {type(e).__name__}."
         )
     finally:
-        try:
-             await bot.delete_message(chat_id=status_message.chat.id, message_id=status_message.message_id)
-        except Exception:
-             pass 
+        # При остановке процесса (отмена) статус оставляем: задача продолжится после перезапуска
+        if finished:
+            telegram_sender.delete(chat_id, status_message_id)
 
 
-# --- Обработчики Telegram (оставлены без изменений) ---
+async def launch_veo_operation(job_id: str, chat_id: int, enhanced_prompt: str, status_message_id: int, image_input_data: genai_types.Image,
+                               total_steps: int):
+    """Запускает операцию Veo и сохраняет ее имя в хранилище задач."""
+    # 1. Запуск генерации видео
+    
+    generate_args = {
+        "model": VEO_MODEL,
+        "prompt": enhanced_prompt,
+        "config": genai_types.GenerateVideosConfig(aspect_ratio=VIDEO_ASPECT_RATIO) # Задаем соотношение сторон
+    }
+    
+    if image_input_data is not None:
+        generate_args["image"] = image_input_data
+        step_number = 2
+    else:
+        step_number = 1
+        
+    telegram_sender.edit_status(
+        chat_id,
+        status_message_id,
+        f"🤖 {step_number}/{total_steps}: Запускаю генерацию видео с {VEO_MODEL}. Ожидайте уведомления (может занять 1-5 минут)..."
+    )
+    
+    operation = await gemini_client.aio.models.generate_videos(**generate_args)
+    operation_name = operation.name
+    
+    logger.info(f"Операция Veo LRO запущена: {operation_name}")
+    job_store.update(
+        job_id,
+        state=STATE_RUNNING,
+        enhanced_prompt=enhanced_prompt,
+        operation_name=operation_name,
+        launched_at=time.time(),
+    )
+    # Имя оплаченной операции записываем сразу, а не через буфер: при падении процесса
+    # в ближайшие flush_interval секунд задача иначе запустила бы Veo повторно
+    await job_store.flush()
+    return operation
+
+
+async def resume_running_job(job: VideoJob, row: dict):
+    """Снова подключается к уже запущенной (и оплаченной) операции Veo задачи."""
+    started_at = time.monotonic() - max(0.0, time.time() - (row["launched_at"] or time.time()))
+    await gemini_ready()
+    operation = genai_types.GenerateVideosOperation(name=row["operation_name"])
+    await veo_video_worker(
+        job.job_id, job.chat_id, row["enhanced_prompt"], job.status_message_id,
+        operation=operation, started_at=started_at,
+    )
+
+
+async def resume_unfinished_jobs():
+    """Возвращает в работу задачи, прерванные перезапуском или редеплоем (очередь в памяти)."""
+    rows = await job_store.unfinished()
+    if not rows:
+        return
+    logger.info(f"Восстановление незавершенных задач: {len(rows)}")
+
+    for row in rows:
+        job = VideoJob(
+            chat_id=row["chat_id"],
+            user_id=row["user_id"],
+            prompt=row["prompt"],
+            status_message_id=row["status_message_id"],
+            photo_file_id=row["photo_file_id"],
+            force=bool(row["force"]),
+            job_id=row["job_id"],
+        )
+        if row["state"] == STATE_RUNNING and row["operation_name"]:
+            # Операция Veo уже оплачена и идет: просто снова подключаемся к опросу.
+            # Она занимает слот общей квоты, пока не будет доставлена.
+            queue_backend.adopt(job)
+            task = asyncio.create_task(resume_running_job(job, row))
+            resumed_tasks.add(task)
+            task.add_done_callback(resumed_tasks.discard)
+            task.add_done_callback(lambda _, job=job: queue_backend.release(job))
+        elif row["state"] == STATE_QUEUED:
+            try:
+                await job_queue.submit(job, check_limits=False)
+            except QueueFullError:
+                job_store.update(job.job_id, state=STATE_FAILED)
+                await send_text(chat_id=job.chat_id, text=QUEUE_FULL_TEXT, parse_mode="Markdown")
+
+
+# Задачи, восстановленные после перезапуска (храним ссылки, чтобы их не собрал GC)
+resumed_tasks: set[asyncio.Task] = set()
+
+
+# --- Обработчики Telegram ---
 
 @dp.message(Command("start"))
 async def handle_start(message: types.Message):
     """Отправляет приветственное сообщение."""
-    await message.answer(
+    await reply(
+        message,
         "👋 Привет! Я бот-генератор видео на базе Veo. "
         "У меня есть два режима работы:\n\n"
         "1. **Генерация с нуля (Текст в Видео)**:\n"
@@ -188,133 +533,459 @@ async def handle_start(message: types.Message):
         "   _(Veo сам сгенерирует исходный кадр)._\n\n"
         "2. **Ваше фото в Видео (Изображение в Видео)**:\n"
         "   **Загрузите фото** с подписью, начинающейся с `#veo [промпт движения]`.\n"
-        "   _(Пример подписи: `#veo Плавное панорамирование камеры влево, с легким ветерком`)"
+        "   _(Пример подписи: `#veo Плавное панорамирование камеры влево, с легким ветерком`)\n\n"
+        "3. **Изображения**:\n"
+        "   Используйте: `/image [число вариантов 1-4] [описание]`, например `/image 4 замок в облаках`.\n\n"
+        "Готовые видео для одинаковых запросов отправляются мгновенно из кэша. "
+        "Чтобы сгенерировать заново, используйте `/video!` или подпись `#veo!`."
+    )
+
+async def enqueue_video_job(message: types.Message, user_prompt: str, status_text: str, photo_file_id: str = None, force: bool = False):
+    """Отправляет статусное сообщение и ставит задачу в очередь (без ожидания генерации)."""
+    if message_deduplicator.seen((message.chat.id, message.message_id)):
+        logger.info(f"Повтор сообщения {message.message_id} в чате {message.chat.id}, задача уже создана.")
+        return
+
+    try:
+        position = job_queue.check(message.from_user.id)
+    except QueueFullError:
+        await reply(message, QUEUE_FULL_TEXT, parse_mode="Markdown")
+        return
+    except RateLimitedError as e:
+        await reply(message, RATE_LIMITED_TEXT.format(retry_after=int(e.retry_after)), parse_mode="Markdown")
+        return
+
+    if position > 0:
+        status_text += f"\n⏳ Позиция в очереди: *{position}*"
+    status_message = await reply(message, status_text, parse_mode="Markdown")
+    job = VideoJob(
+        chat_id=message.chat.id,
+        user_id=message.from_user.id,
+        prompt=user_prompt,
+        status_message_id=status_message.message_id,
+        photo_file_id=photo_file_id,
+        force=force,
     )
+    # Запись сохраняется до постановки в очередь (не через буфер): воркер другого процесса
+    # может взять задачу сразу и должен найти ее в хранилище
+    job_store.add(job.job_id, job.chat_id, job.user_id, job.status_message_id, job.prompt, job.photo_file_id, job.force)
+    await job_store.flush()
+    try:
+        await job_queue.submit(job)
+    except QueueFullError:
+        job_store.update(job.job_id, state=STATE_FAILED)
+        telegram_sender.edit_status(job.chat_id, job.status_message_id, QUEUE_FULL_TEXT, parse_mode="Markdown")
+    except RateLimitedError as e:
+        job_store.update(job.job_id, state=STATE_FAILED)
+        telegram_sender.edit_status(job.chat_id, job.status_message_id,
+                                    RATE_LIMITED_TEXT.format(retry_after=int(e.retry_after)), parse_mode="Markdown")
+
 
+@dp.message(F.text.startswith("/video!"))
 @dp.message(Command("video"))
 async def handle_veo_prompt(message: types.Message):
-    """Обрабатывает команду /video (Генерация с нуля: Прямой вызов Veo Text-to-Video, 2 шага)."""
-    user_prompt = message.text[len('/video'):].strip()
+    """
+    Обрабатывает команду /video (Генерация с нуля: Прямой вызов Veo Text-to-Video, 2 шага).
+    Вариант /video! принудительно генерирует новое видео, не используя кэш результатов.
+    """
+    force = message.text.startswith('/video!')
+    user_prompt = message.text[len('/video!' if force else '/video'):].strip()
     user_id = message.from_user.id
-    chat_id = message.chat.id
 
     if not user_prompt:
-        await message.answer("❌ **Ошибка:** Пожалуйста, укажите описание для видео после команды `/video`.\n"
-                             "Пример: `/video Плавный широкий кадр котенка, спящего на солнышке`")
+        await reply(message, "❌ **Ошибка:** Пожалуйста, укажите описание для видео после команды `/video`.\n"
+                              "Пример: `/video Плавный широкий кадр котенка, спящего на солнышке`")
         return
 
     logger.info(f"Получен промпт для видео (Текст в Видео): {user_prompt} от пользователя {user_id}")
     
-    status_message = await message.answer(
+    await enqueue_video_job(
+        message,
+        user_prompt,
         f"🎥 **Текст в Видео** запущена!\n"
         "Это займет от **1 до 5 минут**.\n"
         "🤖 0/2: Инициализация и улучшение промпта...",
-        parse_mode="Markdown"
+        force=force,
     )
 
+
+@dp.message(Command("image"))
+async def handle_image_prompt(message: types.Message):
+    """
+    Обрабатывает команду /image [N] (Генерация изображений: N вариантов одним вызовом Imagen).
+    Результат отправляется одной медиагруппой. Запрос расходует тот же лимит
+    частоты пользователя, что и видео.
+    """
+    if message_deduplicator.seen((message.chat.id, message.message_id)):
+        logger.info(f"Повтор сообщения {message.message_id} в чате {message.chat.id}, запрос уже обработан.")
+        return
+
+    user_prompt = message.text[len('/image'):].strip()
+    count = 1
+    first, _, rest = user_prompt.partition(" ")
+    if first.isdigit():
+        count = max(1, min(IMAGE_MAX_VARIANTS, int(first)))
+        user_prompt = rest.strip()
+
+    if not user_prompt:
+        await reply(message, "❌ **Ошибка:** Пожалуйста, укажите описание изображения после команды `/image`.\n"
+                              "Пример: `/image 4 Маяк на скале во время шторма`", parse_mode="Markdown")
+        return
+
     try:
-        # 1. Улучшение промпта (Шаг 0/2)
-        enhanced_prompt = await enhance_prompt(user_prompt)
-        
-        # 2. Запуск общего рабочего процесса Veo (без входного изображения)
-        await veo_video_worker(chat_id, enhanced_prompt, status_message, image_input_data=None)
+        await queue_backend.charge(message.from_user.id)
+    except RateLimitedError as e:
+        await reply(message, IMAGE_RATE_LIMITED_TEXT.format(retry_after=int(e.retry_after)), parse_mode="Markdown")
+        return
 
+    logger.info(f"Получен промпт для изображений ({count} шт.): {user_prompt} от пользователя {message.from_user.id}")
+    chat_id = message.chat.id
+    status_message = await reply(message, f"🎨 Генерирую изображения ({count} шт.)...")
+    try:
+        await gemini_ready()
+        images = await image_generator.generate_images(user_prompt, number_of_images=count, aspect_ratio=IMAGE_ASPECT_RATIO)
+        if not images:
+            telegram_sender.edit_status(chat_id, status_message.message_id,
+                                        "❌ Изображение не сгенерировано. Возможно, запрос был отклонен фильтрами.")
+            return
+        await send_images(chat_id, images, image_caption(user_prompt))
+        telegram_sender.delete(chat_id, status_message.message_id)
+    except GeneratorBusyError as e:
+        logger.warning(f"⚠️ Генерация изображений перегружена: {e}")
+        telegram_sender.edit_status(chat_id, status_message.message_id, IMAGE_BUSY_TEXT, parse_mode="Markdown")
+    except genai_errors.APIError as e:
+        ERRORS_TOTAL.inc(stage="image", type=type(e).__name__)
+        logger.error(f"Ошибка API при генерации изображений: {e}")
+        telegram_sender.edit_status(chat_id, status_message.message_id,
+                                    f"❌ **Ошибка API при генерации изображений:** `{e}`", parse_mode="Markdown")
     except Exception as e:
-        logger.error(f"Ошибка в процессе 'Текст в Видео': {e}", exc_info=True)
-        await bot.send_message(
-            chat_id=chat_id, 
-            text=f"❌ **Критическая ошибка:** Ошибка при обработке запроса: {type(e).__name__}."
-        )
+        ERRORS_TOTAL.inc(stage="image", type=type(e).__name__)
+        logger.error(f"Ошибка в процессе генерации изображений: {e}", exc_info=True)
+        telegram_sender.edit_status(chat_id, status_message.message_id,
+                                    f"❌ **Критическая ошибка:** Не удалось сгенерировать изображения: {type(e).__name__}.")
 
 
 @dp.message(F.photo)
 async def handle_user_photo(message: types.Message, bot: Bot):
-    """Обрабатывает загруженные пользователем фотографии (Изображение в Видео, 3 шага)."""
+    """
+    Обрабатывает загруженные пользователем фотографии (Изображение в Видео, 3 шага).
+    Подпись #veo! принудительно генерирует новое видео, не используя кэш результатов.
+    """
     caption = message.caption or ""
     
     if not caption.lower().startswith('#veo'):
         return
 
-    user_prompt = caption[caption.lower().find('#veo') + len('#veo'):].strip()
+    force = caption.lower().startswith('#veo!')
+    user_prompt = caption[len('#veo!' if force else '#veo'):].strip()
     
     if not user_prompt:
-        await message.answer("❌ **Ошибка:** Пожалуйста, укажите промпт движения после `#veo` в подписи к фото.")
+        await reply(message, "❌ **Ошибка:** Пожалуйста, укажите промпт движения после `#veo` в подписи к фото.")
         return
 
-    chat_id = message.chat.id
     photo = message.photo[-1] 
     
     logger.info(f"Получен промпт для видео (Изображение в Видео): {user_prompt} от пользователя {message.from_user.id}")
 
-    status_message = await message.answer(
+    await enqueue_video_job(
+        message,
+        user_prompt,
         f"🎥 **Ваше Фото в Видео** запущена!\n"
         "Это займет от **1 до 5 минут**.\n"
         "🤖 0/3: Загружаю изображение и улучшаю промпт...",
-        parse_mode="Markdown"
+        photo_file_id=photo.file_id,
+        force=force,
     )
-    
+
+
+# --- Обработка задач из очереди ---
+
+async def process_text_job(job: VideoJob):
+    """Текст в Видео: улучшение промпта и запуск Veo."""
     try:
-        # 1. Загрузка и конвертация изображения (Шаг 0/3 - часть)
-        file_info = await bot.get_file(photo.file_id)
-        image_stream = io.BytesIO()
-        await bot.download_file(file_info.file_path, image_stream)
-        image_stream.seek(0)
+        await gemini_ready()
+        # 1. Улучшение промпта (Шаг 0/2)
+        enhanced_prompt = await enhance_prompt(job.prompt)
         
-        # Конвертация в Base64
-        image_base64 = base64.b64encode(image_stream.read()).decode('utf-8')
-
-        image_input_data = {
-            "inlineData": {
-                "data": image_base64,
-                "mimeType": "image/jpeg"
-            }
-        }
+        # 2. Запуск общего рабочего процесса Veo (без входного изображения)
+        result_key = make_result_key(enhanced_prompt, None, VEO_MODEL, VIDEO_ASPECT_RATIO)
+        await veo_video_worker(job.job_id, job.chat_id, enhanced_prompt, job.status_message_id, image_input_data=None,
+                               result_key=result_key, force=job.force)
+
+    except Exception as e:
+        job_store.update(job.job_id, state=STATE_FAILED)
+        ERRORS_TOTAL.inc(stage="text_job", type=type(e).__name__)
+        logger.error(f"Ошибка в процессе 'Текст в Видео': {e}", exc_info=True)
+        await send_text(
+            chat_id=job.chat_id, 
+            text=f"❌ **Критическая ошибка:** Ошибка при обработке запроса: {type(e).__name__}."
+        )
+
+
+async def process_photo_job(job: VideoJob):
+    """Изображение в Видео: загрузка фото, улучшение промпта и запуск Veo."""
+    chat_id = job.chat_id
+    try:
+        # 1. Загрузка изображения (Шаг 0/3 - часть) и подготовка кадра в пуле процессов:
+        # реальный формат, без EXIF, обрезка и уменьшение до кадра видео
+        image_bytes = await download_telegram_file(bot, job.photo_file_id)
+        prepared = await image_preprocessor.prepare(image_bytes)
+        await gemini_ready()
+        image_input_data = genai_types.Image(image_bytes=prepared.data, mime_type=prepared.mime_type)
         
         # 2. Улучшение промпта движения (Шаг 1/3)
-        await bot.edit_message_text(
-            chat_id=chat_id, 
-            message_id=status_message.message_id, 
-            text=f"🤖 1/3: Улучшаю промпт движения: *{user_prompt}*...",
+        telegram_sender.edit_status(
+            chat_id,
+            job.status_message_id,
+            f"🤖 1/3: Улучшаю промпт движения: *{job.prompt}*...",
             parse_mode="Markdown"
         )
-        enhanced_prompt = await enhance_prompt(user_prompt)
+        enhanced_prompt = await enhance_prompt(job.prompt)
         
         # 3. Запуск общего рабочего процесса Veo с пользовательским изображением
-        await veo_video_worker(chat_id, enhanced_prompt, status_message, image_input_data=image_input_data)
+        result_key = make_result_key(enhanced_prompt, hashlib.sha256(prepared.data).hexdigest(), VEO_MODEL, VIDEO_ASPECT_RATIO)
+        await veo_video_worker(job.job_id, chat_id, enhanced_prompt, job.status_message_id, image_input_data=image_input_data,
+                               result_key=result_key, force=job.force)
 
+    except ImageFormatError as e:
+        job_store.update(job.job_id, state=STATE_FAILED)
+        ERRORS_TOTAL.inc(stage="photo_job", type=type(e).__name__)
+        logger.warning(f"Не удалось прочитать фото пользователя: {e}")
+        await send_text(
+            chat_id=chat_id,
+            text="❌ **Не удалось прочитать изображение.** Пожалуйста, отправьте фото в формате JPEG, PNG или WEBP."
+        )
     except Exception as e:
+        job_store.update(job.job_id, state=STATE_FAILED)
+        ERRORS_TOTAL.inc(stage="photo_job", type=type(e).__name__)
         logger.error(f"Ошибка в процессе 'Изображение в Видео': {e}", exc_info=True)
-        await bot.send_message(
+        await send_text(
             chat_id=chat_id, 
             text=f"❌ **Критическая ошибка:** Ошибка при обработке изображения или генерации видео: {type(e).__name__}. "
             "Пожалуйста, убедитесь, что вы загрузили стандартное изображение."
         )
 
 
-# --- Настройка вебхука AIOHTTP (оставлены без изменений) ---
+async def process_video_job(job: VideoJob):
+    """Точка входа воркера пула: выбирает сценарий по типу задачи."""
+    if queue_backend.shared:
+        # Задачу мог начать воркер, который упал или был остановлен: продолжаем с его места
+        row = await job_store.get(job.job_id)
+        if row is not None and row["state"] in (STATE_DONE, STATE_FAILED):
+            logger.info(f"Задача {job.job_id} уже завершена, пропускаем.")
+            return
+        if row is not None and row["state"] == STATE_RUNNING and row["operation_name"]:
+            logger.info(f"Продолжаем опрос операции {row['operation_name']} задачи {job.job_id}.")
+            await resume_running_job(job, row)
+            return
+    if job.is_image_mode:
+        await process_photo_job(job)
+    else:
+        await process_text_job(job)
+
+
+async def fail_exhausted_job(job: VideoJob):
+    """Задача раз за разом роняла воркеры и снята с общей очереди: сообщаем пользователю."""
+    job_store.update(job.job_id, state=STATE_FAILED)
+    await job_store.flush()
+    ERRORS_TOTAL.inc(stage="queue", type="AttemptsExhausted")
+    telegram_sender.delete(job.chat_id, job.status_message_id)
+    await send_text(
+        chat_id=job.chat_id,
+        text="❌ **Не удалось обработать запрос:** генерация несколько раз прерывалась из-за сбоя. "
+             "Пожалуйста, попробуйте отправить запрос еще раз."
+    )
+
+
+scheduler = FairScheduler(
+    max_concurrent=VEO_MAX_CONCURRENT,
+    max_queued=JOB_QUEUE_SIZE,
+    per_user_in_flight=USER_MAX_IN_FLIGHT,
+    per_user_queued=USER_MAX_QUEUED,
+    user_rate=USER_REQUESTS_PER_HOUR / 3600,
+    user_burst=USER_REQUESTS_BURST,
+)
+if QUEUE_BACKEND == "sqlite":
+    queue_backend = SqliteQueueBackend(
+        QUEUE_DB_PATH,
+        max_concurrent=VEO_MAX_CONCURRENT,
+        max_queued=JOB_QUEUE_SIZE,
+        per_user_in_flight=USER_MAX_IN_FLIGHT,
+        per_user_queued=USER_MAX_QUEUED,
+        user_rate=USER_REQUESTS_PER_HOUR / 3600,
+        user_burst=USER_REQUESTS_BURST,
+        lease_ttl=QUEUE_LEASE_TTL,
+        on_exhausted=fail_exhausted_job,
+    )
+else:
+    queue_backend = InProcessQueueBackend(scheduler)
+job_queue = JobQueue(process_video_job, queue_backend, workers=JOB_WORKERS, heartbeat_interval=QUEUE_LEASE_TTL / 3)
+
+
+# --- Метрики состояния (вычисляются в момент запроса /metrics) ---
+REGISTRY.gauge("bot_jobs_in_flight", "Задачи генерации в работе", lambda: queue_backend.running)
+REGISTRY.gauge("bot_jobs_queued", "Задачи генерации в очереди", lambda: queue_backend.queued)
+REGISTRY.gauge("bot_veo_operations_in_flight", "Операции Veo под наблюдением опросчика", lambda: operation_tracker.in_flight)
+REGISTRY.gauge("bot_event_loop_lag_seconds", "Последняя измеренная задержка цикла событий", lambda: loop_lag_monitor.last_lag)
+REGISTRY.gauge("bot_event_loop_lag_max_seconds", "Максимальная задержка цикла событий с запуска", lambda: loop_lag_monitor.max_lag)
+REGISTRY.gauge("bot_telegram_outbound_pending", "Запросы к Telegram в очереди отправки", lambda: telegram_sender.pending)
+REGISTRY.counter_fn("bot_prompt_cache_hits_total", "Попадания в кэш улучшенных промптов", lambda: prompt_cache.hits)
+REGISTRY.counter_fn("bot_prompt_cache_misses_total", "Промахи кэша улучшенных промптов", lambda: prompt_cache.misses)
+REGISTRY.counter_fn("bot_prompt_cache_coalesced_total", "Запросы, объединенные с уже идущим улучшением", lambda: prompt_cache.coalesced)
+REGISTRY.counter_fn("bot_enhance_batches_total", "Запросы к модели для улучшения промптов (пакеты)", lambda: prompt_batcher.batches)
+REGISTRY.counter_fn("bot_result_cache_hits_total", "Видео, отданные из кэша результатов", lambda: result_cache.hits)
+REGISTRY.counter_fn("bot_result_cache_misses_total", "Промахи кэша результатов", lambda: result_cache.misses)
+REGISTRY.counter_fn("bot_duplicate_updates_total", "Отброшенные повторные обновления", lambda: update_deduplicator.suppressed)
+REGISTRY.counter_fn("bot_duplicate_messages_total", "Отброшенные повторные сообщения", lambda: message_deduplicator.suppressed)
+REGISTRY.counter_fn("bot_image_model_calls_total", "Вызовы модели генерации изображений", lambda: image_generator.calls)
+REGISTRY.counter_fn("bot_image_rejected_total", "Запросы изображений, отклоненные из-за перегрузки", lambda: image_generator.rejected)
+REGISTRY.counter_fn("bot_image_coalesced_total", "Запросы изображений, объединенные с уже идущим вызовом", lambda: image_generator.coalesced)
+REGISTRY.counter_fn("bot_telegram_coalesced_edits_total", "Объединенные правки статусов", lambda: telegram_sender.coalesced_edits)
+REGISTRY.counter_fn("bot_telegram_retry_after_total", "Ответы Telegram с retry_after", lambda: telegram_sender.retry_after_hits)
 
-async def on_startup(app):
-    """Устанавливает вебхук при запуске приложения."""
+
+# --- Настройка вебхука AIOHTTP ---
+
+async def ensure_webhook():
+    """Регистрирует вебхук, только если Telegram знает другой адрес (без окна потери обновлений)."""
     try:
-        await bot.delete_webhook()
-        if WEBHOOK_HOST:
-            logger.info(f"Установка вебхука на: {WEBHOOK_URL}")
-            await bot.set_webhook(url=WEBHOOK_URL)
-            logger.info(f"✅ Вебхук установлен: {WEBHOOK_URL}")
-        else:
-            logger.error("❌ WEBHOOK_HOST не установлен, вебхук не может быть настроен.")
-            
+        info = await bot.get_webhook_info()
+        if info.url == WEBHOOK_URL:
+            logger.info(f"✅ Вебхук уже установлен: {WEBHOOK_URL}")
+            return
+        logger.info(f"Установка вебхука на: {WEBHOOK_URL} (был: {info.url or 'не установлен'})")
+        # set_webhook заменяет прежний адрес, удалять его заранее не нужно
+        await bot.set_webhook(url=WEBHOOK_URL)
+        logger.info(f"✅ Вебхук установлен: {WEBHOOK_URL}")
     except Exception as e:
         logger.error(f"❌ Ошибка при установке вебхука: {e}")
 
+
+async def load_gemini():
+    """Импортирует SDK Gemini и создает клиент в отдельных потоках, не блокируя цикл событий."""
+    await asyncio.to_thread(genai.load)
+    await asyncio.to_thread(genai_types.load)
+    await asyncio.to_thread(genai_errors.load)
+    await asyncio.to_thread(gemini_client.get)
+
+
+async def gemini_ready():
+    """
+    Ждет, пока SDK Gemini загружен и клиент создан.
+
+    Все пути, которым нужен Gemini, ждут одну и ту же загрузку (фоновую после
+    запуска или начатую здесь), а не импортируют SDK синхронно в цикле событий.
+    После неудачной загрузки следующий вызов пробует снова.
+    """
+    global gemini_loading
+    if gemini_client.created:
+        return
+    if gemini_loading is None or gemini_loading.done():
+        gemini_loading = asyncio.create_task(load_gemini())
+    await asyncio.shield(gemini_loading)
+
+
+async def warm_up_gemini():
+    """Загружает SDK Gemini и создает клиент, пока бот уже принимает обновления."""
+    try:
+        await gemini_ready()
+    except Exception as e:
+        logger.error(f"❌ Ошибка инициализации Gemini клиента: {e}")
+
+
+async def persist_periodically():
+    """Периодически сохраняет кэши на диск: при аварийной остановке теряется не больше одного интервала."""
+    while True:
+        await asyncio.sleep(PERSIST_INTERVAL_SECONDS)
+        await prompt_cache.save()
+        await update_deduplicator.save()
+        await message_deduplicator.save()
+
+
+async def on_startup(timer: StartupTimer):
+    """Запускает пул воркеров, восстанавливает прерванные задачи и устанавливает вебхук."""
+    if BOT_ROLE != "web":
+        # Первым: процессы пула создаются до потоков хранилищ
+        await image_preprocessor.start()
+        timer.mark("пул изображений")
+    await job_store.open()
+    await result_cache.open()
+    await queue_backend.open()
+    timer.mark("хранилища")
+    await prompt_cache.load()
+    await message_deduplicator.load()
+    timer.mark("кэши")
+    telegram_sender.start()
+    loop_lag_monitor.start()
+    if BOT_ROLE != "web":
+        job_queue.start()
+        operation_tracker.start()
+    if not queue_backend.shared:
+        await resume_unfinished_jobs()
+    timer.mark("воркеры")
+    if FAST_START:
+        background_tasks.add(asyncio.create_task(warm_up_gemini()))
+    else:
+        await warm_up_gemini()
+        timer.mark("Gemini SDK")
+    background_tasks.add(asyncio.create_task(persist_periodically()))
+    services_ready.set()
+    if BOT_ROLE != "worker":
+        # Вебхук принимают процессы с ролями all и web
+        await ensure_webhook()
+        timer.mark("вебхук")
+
 async def on_shutdown(app):
-    """Удаляет вебхук при остановке приложения."""
-    logger.info("Удаление вебхука...")
+    """Удаляет вебхук и останавливает пул воркеров при остановке приложения."""
+    # Общий вебхук нескольких экземпляров не снимаем: его продолжают обслуживать остальные
+    if WEBHOOK_DELETE_ON_SHUTDOWN and BOT_ROLE != "worker" and not queue_backend.shared:
+        logger.info("Удаление вебхука...")
+        try:
+            await bot.delete_webhook()
+            logger.info("✅ Вебхук удален.")
+        except Exception as e:
+            logger.warning(f"Ошибка при удалении вебхука (возможно, он не был установлен): {e}")
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await job_queue.stop()
+    await prompt_batcher.close()
+    for task in resumed_tasks:
+        task.cancel()
+    await asyncio.gather(*resumed_tasks, return_exceptions=True)
+    await operation_tracker.stop()
+    await telegram_sender.stop()
+    await job_store.close()
+    await queue_backend.close()
+    await image_preprocessor.close()
+    await result_cache.close()
+    await close_session()
+    await prompt_cache.save()
+    await update_deduplicator.save()
+    await message_deduplicator.save()
+    await loop_lag_monitor.stop()
+
+# Фоновые задачи обработки обновлений (храним ссылки, чтобы их не собрал GC)
+update_tasks: set[asyncio.Task] = set()
+background_tasks: set[asyncio.Task] = set()
+# Устанавливается, когда хранилища и воркеры запущены (веб-сервер стартует раньше)
+services_ready = asyncio.Event()
+first_update_handled = False
+
+async def process_update(telegram_update: types.Update):
+    """Передает обновление диспетчеру вне HTTP-запроса вебхука."""
+    global first_update_handled
     try:
-        await bot.delete_webhook()
-        logger.info("✅ Вебхук удален.")
+        await services_ready.wait()
+        with FEED_UPDATE_SECONDS.time():
+            await dp.feed_update(bot, telegram_update)
+        logger.info("Обновление обработано успешно.")
+        if not first_update_handled:
+            first_update_handled = True
+            logger.info(f"Первое обновление обработано через {(time.perf_counter() - PROCESS_STARTED) * 1000:.0f} мс после старта процесса.")
     except Exception as e:
-        logger.warning(f"Ошибка при удалении вебхука (возможно, он не был установлен): {e}")
+        ERRORS_TOTAL.inc(stage="update", type=type(e).__name__)
+        logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
 
 async def handle_webhook(request):
     """Обрабатывает входящие обновления от Telegram."""
@@ -324,34 +995,66 @@ async def handle_webhook(request):
     try:
         update_data = await request.json()
         telegram_update = types.Update(**update_data)
-        
-        await dp.feed_update(bot, telegram_update)
-        logger.info("Обновление обработано успешно.")
-        return web.Response()
     except Exception as e:
-        logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
-        return web.Response(status=200) 
+        ERRORS_TOTAL.inc(stage="webhook", type=type(e).__name__)
+        logger.error(f"Некорректное обновление: {e}", exc_info=True)
+        return web.Response(status=200)
+
+    if update_deduplicator.seen(telegram_update.update_id):
+        logger.info(f"Повторная доставка обновления {telegram_update.update_id}, пропускаем.")
+        return web.Response()
+
+    # Отвечаем Telegram сразу: обработчики только ставят задачи в очередь,
+    # а генерацию выполняет пул воркеров.
+    task = asyncio.create_task(process_update(telegram_update))
+    update_tasks.add(task)
+    task.add_done_callback(update_tasks.discard)
+    return web.Response()
 
 async def main():
-    """Главная функция для запуска веб-сервера."""
-    
+    """
+    Главная функция для запуска веб-сервера.
+
+    Веб-сервер стартует первым: Telegram сразу получает ответы на вебхук,
+    а обновления обрабатываются, как только будут готовы хранилища и воркеры.
+    По SIGTERM/SIGINT приложение останавливается штатно: runner.cleanup()
+    вызывает on_shutdown, задачи возвращаются в очередь, а хранилища и кэши
+    сохраняются на диск.
+    """
+    timer = StartupTimer(PROCESS_STARTED)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    timer.mark("импорт")
+    # Фильтр повторов нужен вебхуку с первого запроса
+    await update_deduplicator.load()
+
     app = web.Application()
-    app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
     
-    app.router.add_post(WEBHOOK_PATH, handle_webhook)
+    if BOT_ROLE != "worker":
+        app.router.add_post(WEBHOOK_PATH, handle_webhook)
+    app.router.add_get("/metrics", metrics_handler)
     
     logger.info(f"Запуск веб-сервера на хосте: {WEB_SERVER_HOST}, порту: {WEB_SERVER_PORT}")
     runner = web.AppRunner(app)
     await runner.setup()
-    
-    site = web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT)
-    await site.start()
-    
-    logger.info("✅ Приложение успешно запущено и ожидает запросов от Telegram.")
-    
-    while True:
-        await asyncio.sleep(3600)
+    try:
+        site = web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT)
+        await site.start()
+        timer.mark("веб-сервер")
+
+        await on_startup(timer)
+        STARTUP_SECONDS.set(timer.total)
+        logger.info(f"✅ Приложение успешно запущено и ожидает запросов от Telegram. Запуск: {timer.report()}")
+
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, завершаем работу...")
+    finally:
+        # Останавливает сайт и вызывает on_shutdown
+        await runner.cleanup()
+        logger.info("✅ Приложение остановлено.")
 
 if __name__ == '__main__':
     try:
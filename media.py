@@ -0,0 +1,104 @@
+# media.py
+import io
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, FSInputFile, InputFile
+
+from metrics import TELEGRAM_DOWNLOAD_BYTES, TELEGRAM_DOWNLOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Результаты больше этого размера не держим в памяти, а пишем во временный файл
+SPOOL_THRESHOLD = 4 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Общая HTTP-сессия для скачивания результатов (создается при первом использовании)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600, sock_read=60))
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def download_telegram_file(bot: Bot, file_id: str) -> bytes:
+    """
+    Скачивает файл из Telegram одним буфером.
+
+    Байты передаются в SDK как есть (без base64 и промежуточных строк):
+    SDK сам кодирует их один раз при отправке запроса.
+    """
+    started = time.perf_counter()
+    file_info = await bot.get_file(file_id)
+    buffer = io.BytesIO()
+    await bot.download_file(file_info.file_path, buffer)
+    data = buffer.getvalue()
+    TELEGRAM_DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+    TELEGRAM_DOWNLOAD_BYTES.observe(len(data))
+    return data
+
+
+def input_file_size(input_file: InputFile) -> int:
+    """Размер файла, подготовленного к отправке в Telegram (для метрик)."""
+    if isinstance(input_file, BufferedInputFile):
+        return len(input_file.data)
+    if isinstance(input_file, FSInputFile):
+        return os.path.getsize(input_file.path)
+    return 0
+
+
+@asynccontextmanager
+async def video_input_file(video, api_key: str, filename: str = "generated_video.mp4"):
+    """
+    Готовит результат Veo к отправке в Telegram.
+
+    Если видео пришло в ответе (video_bytes), оно отправляется из памяти без
+    копирования. Иначе оно скачивается по `video.uri` потоково: небольшие
+    файлы — в память, крупные — частями во временный файл, который загружается
+    в Telegram через FSInputFile и удаляется после выхода из контекста.
+    """
+    if getattr(video, "video_bytes", None):
+        yield BufferedInputFile(video.video_bytes, filename=filename)
+        return
+
+    if not getattr(video, "uri", None):
+        raise ValueError("Ответ Veo не содержит ни данных видео, ни ссылки на него")
+
+    tmp_path = None
+    try:
+        async with get_session().get(video.uri, headers={"x-goog-api-key": api_key}) as response:
+            response.raise_for_status()
+            size = response.content_length
+            if size is not None and size <= SPOOL_THRESHOLD:
+                yield BufferedInputFile(await response.read(), filename=filename)
+                return
+
+            fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+            written = 0
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+            logger.info(f"Видео сохранено во временный файл: {written / 1024 / 1024:.1f} МБ")
+        yield FSInputFile(tmp_path, filename=filename)
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,169 @@
+# metrics.py
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from aiohttp import web
+
+# Границы бакетов по умолчанию (секунды): от миллисекунд до десятков минут
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+BYTES_BUCKETS = (10_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 25_000_000, 50_000_000, 100_000_000)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонный счетчик (обычно с меткой типа события)."""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией в момент сбора."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], float] | None = None):
+        super().__init__(name, help_text)
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> list[str]:
+        value = self.fn() if self.fn is not None else self.value
+        return super().render() + [f"{self.name} {value}"]
+
+
+class CallbackCounter(Gauge):
+    """Счетчик, значение которого берется из уже существующего атрибута компонента."""
+    kind = "counter"
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными бакетами: observe — O(log число бакетов)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS, labels: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # [счетчики по бакетам (+Inf последним), сумма]
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], float] | None = None) -> Gauge:
+        return self.register(Gauge(name, help_text, fn))
+
+    def counter_fn(self, name: str, help_text: str, fn: Callable[[], float]) -> CallbackCounter:
+        return self.register(CallbackCounter(name, help_text, fn))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+                  labels: tuple[str, ...] = ()) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Метрики горячего пути ---
+FEED_UPDATE_SECONDS = REGISTRY.histogram("bot_feed_update_seconds", "Длительность dp.feed_update")
+ENHANCE_PROMPT_SECONDS = REGISTRY.histogram("bot_enhance_prompt_seconds", "Задержка enhance_prompt (включая кэш)")
+VEO_FIRST_POLL_SECONDS = REGISTRY.histogram("bot_veo_time_to_first_poll_seconds", "Время от запуска операции Veo до первого опроса")
+VEO_LRO_SECONDS = REGISTRY.histogram("bot_veo_lro_duration_seconds", "Полная длительность операции Veo")
+TELEGRAM_DOWNLOAD_SECONDS = REGISTRY.histogram("bot_telegram_download_seconds", "Время скачивания файлов из Telegram")
+TELEGRAM_DOWNLOAD_BYTES = REGISTRY.histogram("bot_telegram_download_bytes", "Размер файлов, скачанных из Telegram", BYTES_BUCKETS)
+TELEGRAM_UPLOAD_SECONDS = REGISTRY.histogram("bot_telegram_upload_seconds", "Время загрузки видео в Telegram")
+TELEGRAM_UPLOAD_BYTES = REGISTRY.histogram("bot_telegram_upload_bytes", "Размер видео, загруженных в Telegram", BYTES_BUCKETS)
+ENHANCE_BATCH_SIZE = REGISTRY.histogram("bot_enhance_batch_size", "Заполнение пакетов улучшения промптов", (1, 2, 4, 8, 16, 32, 64))
+ENHANCE_BATCH_WAIT_SECONDS = REGISTRY.histogram("bot_enhance_batch_wait_seconds", "Ожидание промпта в окне пакета")
+ENHANCE_BATCH_SECONDS = REGISTRY.histogram("bot_enhance_batch_seconds", "Длительность пакетного запроса улучшения промптов")
+ENHANCE_BATCH_FALLBACKS = REGISTRY.counter("bot_enhance_batch_fallbacks_total", "Промпты, улучшенные отдельно после сбоя разбора пакета", labels=("reason",))
+IMAGE_PREP_SECONDS = REGISTRY.histogram("bot_image_prep_seconds", "Подготовка фото для Veo (включая ожидание пула процессов)")
+IMAGE_PREP_BYTES = REGISTRY.histogram("bot_image_prep_bytes", "Размер фото до и после подготовки", BYTES_BUCKETS, labels=("stage",))
+IMAGE_GENERATE_SECONDS = REGISTRY.histogram("bot_image_generate_seconds", "Длительность вызова модели генерации изображений")
+STARTUP_SECONDS = REGISTRY.gauge("bot_startup_seconds", "Время запуска процесса по всем этапам (до регистрации вебхука)")
+ERRORS_TOTAL = REGISTRY.counter("bot_errors_total", "Ошибки по этапу и типу исключения", labels=("stage", "type"))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Отдает метрики в текстовом формате Prometheus."""
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,126 @@
+# prompt_batcher.py
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from metrics import ENHANCE_BATCH_FALLBACKS, ENHANCE_BATCH_SECONDS, ENHANCE_BATCH_SIZE, ENHANCE_BATCH_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class BatchParseError(ValueError):
+    """Ответ модели на пакетный запрос не удалось разобрать."""
+
+
+class PromptBatcher:
+    """
+    Микропакетирование улучшения промптов.
+
+    Промпты, пришедшие в течение `window` секунд (или пока не наберется
+    `max_batch` штук), отправляются модели одним запросом: системная инструкция
+    передается один раз, а ответ — JSON-массив улучшенных промптов в том же
+    порядке. Результаты раздаются ожидающим вызовам.
+
+    Если ответ не разобрался целиком или отдельные элементы пустые, эти
+    промпты улучшаются по одному через `enhance_one`. Ошибка API самого
+    пакетного запроса передается всем ожидающим (как и при одиночном вызове).
+    """
+    def __init__(
+        self,
+        enhance_one: Callable[[str], Awaitable[str]],
+        enhance_batch: Callable[[list[str]], Awaitable[list]],
+        window: float = 0.1,
+        max_batch: int = 16,
+    ):
+        self.enhance_one = enhance_one
+        self.enhance_batch = enhance_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: list[tuple[str, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.fallbacks = 0
+
+    async def enhance(self, prompt: str) -> str:
+        """Улучшает промпт в составе ближайшего пакета."""
+        if self.max_batch <= 1:
+            return await self.enhance_one(prompt)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((prompt, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Отправляет накопленное и дожидается запросов в работе."""
+        self._flush()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # --- Выполнение пакета ---
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future, float]]):
+        started = time.perf_counter()
+        for _, _, queued_at in batch:
+            ENHANCE_BATCH_WAIT_SECONDS.observe(started - queued_at)
+        ENHANCE_BATCH_SIZE.observe(len(batch))
+        self.batches += 1
+
+        prompts = [prompt for prompt, _, _ in batch]
+        if len(batch) == 1:
+            # Пакет из одного промпта — обычный одиночный запрос
+            results = [None]
+        else:
+            try:
+                with ENHANCE_BATCH_SECONDS.time():
+                    results = await self.enhance_batch(prompts)
+                if not isinstance(results, list) or len(results) != len(prompts):
+                    raise BatchParseError(f"ожидалось {len(prompts)} элементов")
+            except BatchParseError as e:
+                logger.warning(f"⚠️ Пакетный ответ модели не разобран ({len(prompts)} промптов): {e}")
+                ENHANCE_BATCH_FALLBACKS.inc(len(prompts), reason="parse")
+                self.fallbacks += len(prompts)
+                results = [None] * len(prompts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            else:
+                for i, result in enumerate(results):
+                    if not (isinstance(result, str) and result.strip()):
+                        ENHANCE_BATCH_FALLBACKS.inc(reason="item")
+                        self.fallbacks += 1
+                        results[i] = None
+
+        await asyncio.gather(*(
+            self._resolve(prompt, future, result)
+            for (prompt, future, _), result in zip(batch, results)
+        ))
+
+    async def _resolve(self, prompt: str, future: asyncio.Future, result: str | None):
+        """Отдает результат ожидающему; None — улучшить промпт отдельным запросом."""
+        if result is None:
+            try:
+                result = await self.enhance_one(prompt)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+        if not future.done():
+            future.set_result(result.strip())
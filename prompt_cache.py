@@ -0,0 +1,124 @@
+# prompt_cache.py
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Приводит промпт к каноническому виду: регистр, пробелы, крайняя пунктуация."""
+    prompt = re.sub(r"\s+", " ", prompt.casefold()).strip()
+    return prompt.strip(" .,!?;:…\"'«»")
+
+
+class PromptCache:
+    """
+    Кэш улучшенных промптов с ограничением размера (LRU) и временем жизни (TTL).
+
+    Ключ — модель и нормализованный промпт. Одновременные запросы с одинаковым
+    ключом объединяются (single-flight): к модели уходит один вызов, а результат
+    получают все ожидающие. Ошибки не кэшируются.
+
+    При заданном `path` содержимое сохраняется в JSON-файл периодически и при
+    остановке и загружается при запуске.
+    """
+    def __init__(self, max_size: int = 1000, ttl: float = 24 * 3600, path: str | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def coalesced(self) -> int:
+        return self._flights.coalesced
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        return f"{model}\n{normalize_prompt(prompt)}"
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str, stored_at: float | None = None):
+        self._entries[key] = (stored_at or time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, model: str, prompt: str, compute: Callable[[str], Awaitable[str]]) -> str:
+        """Возвращает значение из кэша или вычисляет его один раз для всех ожидающих."""
+        key = self.make_key(model, prompt)
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        async def compute_and_put() -> str:
+            self.misses += 1
+            value = await compute(prompt)
+            self.put(key, value)
+            return value
+
+        return await self._flights.run(key, compute_and_put)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+    # --- Сохранение на диск ---
+
+    def _load_sync(self):
+        with open(self.path, encoding="utf-8") as f:
+            items = json.load(f)
+        for key, stored_at, value in items:
+            if time.time() - stored_at <= self.ttl:
+                self.put(key, value, stored_at)
+
+    def _save_sync(self, items: list):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            await asyncio.to_thread(self._load_sync)
+            logger.info(f"Кэш промптов загружен: {len(self._entries)} записей из {self.path}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось загрузить кэш промптов из {self.path}: {e}")
+
+    async def save(self):
+        if not self.path:
+            return
+        # Снимок берется в цикле событий: put()/get() могут менять словарь, пока поток пишет файл
+        items = [[key, stored_at, value] for key, (stored_at, value) in self._entries.items()]
+        try:
+            await asyncio.to_thread(self._save_sync, items)
+            logger.info(f"Кэш промптов сохранен: {len(self._entries)} записей, статистика: {self.stats()}")
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш промптов в {self.path}: {e}")
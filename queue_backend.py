@@ -0,0 +1,425 @@
+# queue_backend.py
+import asyncio
+import dataclasses
+import json
+import logging
+import math
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+from jobs import VideoJob
+from scheduler import FairScheduler, QueueFullError, RateLimitedError
+
+logger = logging.getLogger(__name__)
+
+
+class QueueBackend:
+    """
+    Интерфейс очереди задач с арендой (lease).
+
+    Приемник вебхуков вызывает `check`/`submit`, воркеры — `lease`, периодически
+    `heartbeat` во время работы и `complete` по завершении. Если воркер
+    останавливается, задача возвращается в очередь через `abandon`; если он
+    умер, аренда истекает и задачу забирает другой воркер.
+    """
+    shared = False  # True — очередь общая для нескольких процессов
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def is_full(self) -> bool:
+        raise NotImplementedError
+
+    def check(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    async def submit(self, job: VideoJob, check_limits: bool = True) -> int:
+        raise NotImplementedError
+
+    async def charge(self, user_id: int):
+        """Списывает токен лимита частоты пользователя за запрос вне очереди (RateLimitedError — лимит исчерпан)."""
+        raise NotImplementedError
+
+    async def lease(self, worker_id: str) -> VideoJob:
+        raise NotImplementedError
+
+    async def heartbeat(self, job: VideoJob, worker_id: str) -> bool:
+        return True
+
+    async def complete(self, job: VideoJob, worker_id: str):
+        raise NotImplementedError
+
+    async def abandon(self, job: VideoJob, worker_id: str):
+        raise NotImplementedError
+
+    @property
+    def running(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def queued(self) -> int:
+        raise NotImplementedError
+
+
+class InProcessQueueBackend(QueueBackend):
+    """Очередь в памяти процесса поверх FairScheduler (режим одного экземпляра)."""
+    def __init__(self, scheduler: FairScheduler):
+        self.scheduler = scheduler
+        self.max_concurrent = scheduler.max_concurrent
+        self.max_queued = scheduler.max_queued
+
+    def is_full(self) -> bool:
+        return self.scheduler.is_full()
+
+    def check(self, user_id: int) -> int:
+        return self.scheduler.check(user_id)
+
+    async def submit(self, job: VideoJob, check_limits: bool = True) -> int:
+        return self.scheduler.submit(job, check_limits)
+
+    async def charge(self, user_id: int):
+        self.scheduler.charge(user_id)
+
+    async def lease(self, worker_id: str) -> VideoJob:
+        return await self.scheduler.get()
+
+    async def complete(self, job: VideoJob, worker_id: str):
+        self.scheduler.release(job)
+
+    async def abandon(self, job: VideoJob, worker_id: str):
+        # Задача остается в хранилище задач и будет восстановлена после перезапуска
+        self.scheduler.release(job)
+
+    def adopt(self, job: VideoJob):
+        self.scheduler.adopt(job)
+
+    def release(self, job: VideoJob):
+        self.scheduler.release(job)
+
+    @property
+    def running(self) -> int:
+        return self.scheduler.running
+
+    @property
+    def queued(self) -> int:
+        return self.scheduler.queued
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_queue (
+    job_id           TEXT PRIMARY KEY,
+    user_id          INTEGER NOT NULL,
+    payload          TEXT NOT NULL,
+    state            TEXT NOT NULL,
+    lease_owner      TEXT,
+    lease_expires_at REAL,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    enqueued_at      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_queue_state ON job_queue (state, enqueued_at);
+CREATE TABLE IF NOT EXISTS user_buckets (
+    user_id    INTEGER PRIMARY KEY,
+    tokens     REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def _active(alias: str = "") -> str:
+    """Условие SQL: задача выдана воркеру, и срок аренды не истек."""
+    return f"({alias}state = 'leased' AND {alias}lease_expires_at >= :now)"
+
+
+def _available(alias: str = "") -> str:
+    """Условие SQL: задача ждет воркера (в очереди или с истекшей арендой)."""
+    return f"({alias}state = 'queued' OR ({alias}state = 'leased' AND {alias}lease_expires_at < :now))"
+
+
+class SqliteQueueBackend(QueueBackend):
+    """
+    Общая очередь на SQLite для нескольких процессов на одной машине (или общем диске).
+
+    Выдача задачи — одна транзакция BEGIN IMMEDIATE: соблюдаются общая квота
+    `max_concurrent` и лимит задач пользователя в работе, а среди доступных
+    задач первыми идут пользователи с наименьшим числом задач в работе.
+    Воркер продлевает аренду раз в треть `lease_ttl`; задачу с истекшей арендой
+    (воркер упал) забирает любой другой воркер. Лимит частоты запросов — тот же
+    token bucket, что в FairScheduler (`user_rate` в секунду, запас `user_burst`),
+    только его состояние хранится в базе и общее для всех приемников. Полные
+    bucket из базы удаляются: отсутствие строки означает полный запас.
+
+    Задачу, аренда которой истекла `max_attempts` раз подряд (она раз за разом
+    роняет воркер), снимаем с очереди и передаем в `on_exhausted`, чтобы
+    пометить ее ошибкой и сообщить пользователю. Штатный возврат задачи через
+    `abandon` (остановка процесса, редеплой) попыткой не считается.
+    """
+    shared = True
+
+    def __init__(
+        self,
+        path: str = "jobs.db",
+        max_concurrent: int = 4,
+        max_queued: int = 100,
+        per_user_in_flight: int = 1,
+        per_user_queued: int = 5,
+        user_rate: float = 1 / 30,
+        user_burst: float = 3,
+        lease_ttl: float = 60.0,
+        poll_interval: float = 0.5,
+        max_attempts: int = 3,
+        on_exhausted: Callable[[VideoJob], Awaitable[None]] | None = None,
+    ):
+        self.path = path
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.per_user_in_flight = per_user_in_flight
+        self.per_user_queued = per_user_queued
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.on_exhausted = on_exhausted
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="queue-backend")
+        self._conn: sqlite3.Connection | None = None
+        # Счетчики с последнего обращения к базе (для check и метрик без запроса к БД)
+        self._running = 0
+        self._queued = 0
+        self._user_queued: dict[int, int] = {}
+        self._user_active: dict[int, int] = {}
+        self._user_buckets: dict[int, tuple[float, float]] = {}
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open_sync(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+
+    async def open(self):
+        await self._call(self._open_sync)
+        await self._call(self._refresh_sync, time.time())
+        logger.info(f"✅ Общая очередь задач открыта: {self.path}")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    # --- Синхронная часть (выполняется в отдельном потоке) ---
+
+    def _refresh_sync(self, now: float):
+        conn = self._conn
+        self._running = conn.execute(f"SELECT COUNT(*) FROM job_queue WHERE {_active()}", {"now": now}).fetchone()[0]
+        self._queued = conn.execute(f"SELECT COUNT(*) FROM job_queue WHERE {_available()}", {"now": now}).fetchone()[0]
+        self._user_queued = dict(conn.execute(
+            f"SELECT user_id, COUNT(*) FROM job_queue WHERE {_available()} GROUP BY user_id", {"now": now}
+        ).fetchall())
+        self._user_active = dict(conn.execute(
+            f"SELECT user_id, COUNT(*) FROM job_queue WHERE {_active()} GROUP BY user_id", {"now": now}
+        ).fetchall())
+        self._user_buckets = {
+            user_id: (tokens, updated_at)
+            for user_id, tokens, updated_at in conn.execute("SELECT user_id, tokens, updated_at FROM user_buckets").fetchall()
+        }
+
+    def _tokens(self, user_id: int, now: float) -> float:
+        """Запас token bucket пользователя на момент `now` (как TokenBucket._refill)."""
+        tokens, updated_at = self._user_buckets.get(user_id, (self.user_burst, now))
+        return min(self.user_burst, tokens + (now - updated_at) * self.user_rate)
+
+    @staticmethod
+    def _adjust(counts: dict[int, int], user_id: int, delta: int):
+        count = counts.get(user_id, 0) + delta
+        if count > 0:
+            counts[user_id] = count
+        else:
+            counts.pop(user_id, None)
+
+    def _check_counts(self, user_id: int, now: float) -> int:
+        if self._queued >= self.max_queued or self._user_queued.get(user_id, 0) >= self.per_user_queued:
+            raise QueueFullError()
+        tokens = self._tokens(user_id, now)
+        if tokens < 1:
+            raise RateLimitedError(math.ceil((1 - tokens) / self.user_rate))
+        # Как FairScheduler._position: задача ждет и общего свободного слота, и личного
+        free_slots = self.max_concurrent - self._running
+        user_queued = self._user_queued.get(user_id, 0)
+        user_free_slots = self.per_user_in_flight - self._user_active.get(user_id, 0)
+        return max(0, self._queued + 1 - free_slots, user_queued + 1 - user_free_slots)
+
+    def _submit_sync(self, job: VideoJob, check_limits: bool, now: float) -> int:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._refresh_sync(now)
+            position = self._check_counts(job.user_id, now) if check_limits else 0
+            conn.execute(
+                "INSERT OR IGNORE INTO job_queue (job_id, user_id, payload, state, enqueued_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job.job_id, job.user_id, json.dumps(dataclasses.asdict(job)), now),
+            )
+            if check_limits:
+                self._take_token_sync(job.user_id, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._queued += 1
+        self._adjust(self._user_queued, job.user_id, 1)
+        return position
+
+    def _take_token_sync(self, user_id: int, now: float):
+        """Забирает токен пользователя (внутри транзакции) и удаляет полные bucket остальных."""
+        tokens = self._tokens(user_id, now) - 1
+        self._conn.execute("INSERT OR REPLACE INTO user_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?)",
+                           (user_id, tokens, now))
+        self._conn.execute(
+            "DELETE FROM user_buckets WHERE tokens + (:now - updated_at) * :rate >= :burst",
+            {"now": now, "rate": self.user_rate, "burst": self.user_burst},
+        )
+        self._user_buckets[user_id] = (tokens, now)
+
+    def _charge_sync(self, user_id: int, now: float):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM user_buckets WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                self._user_buckets.pop(user_id, None)
+            else:
+                self._user_buckets[user_id] = row
+            tokens = self._tokens(user_id, now)
+            if tokens < 1:
+                raise RateLimitedError(math.ceil((1 - tokens) / self.user_rate))
+            self._take_token_sync(user_id, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _lease_sync(self, worker_id: str, now: float) -> tuple[VideoJob | None, bool]:
+        """Возвращает (задача, исчерпаны ли попытки) или (None, False), если выдать нечего."""
+        conn = self._conn
+        params = {"now": now, "per_user": self.per_user_in_flight}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._refresh_sync(now)
+            if self._running >= self.max_concurrent:
+                conn.execute("COMMIT")
+                return None, False
+            row = conn.execute(
+                f"""
+                SELECT q.job_id, q.payload, q.attempts,
+                       (SELECT COUNT(*) FROM job_queue a WHERE a.user_id = q.user_id AND {_active("a.")}) AS user_active
+                FROM job_queue q
+                WHERE {_available("q.")}
+                  AND user_active < :per_user
+                ORDER BY user_active, q.enqueued_at
+                LIMIT 1
+                """,
+                params,
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None, False
+            job_id, payload, attempts, _ = row
+            if attempts >= self.max_attempts:
+                logger.error(f"❌ Задача {job_id} брошена {attempts} воркерами подряд и снята с очереди.")
+                conn.execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+                conn.execute("COMMIT")
+                job = VideoJob(**json.loads(payload))
+                self._queued -= 1
+                self._adjust(self._user_queued, job.user_id, -1)
+                return job, True
+            conn.execute(
+                "UPDATE job_queue SET state = 'leased', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1 WHERE job_id = ?",
+                (worker_id, now + self.lease_ttl, job_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if attempts:
+            logger.warning(f"Задача {job_id} перехвачена воркером {worker_id} (попытка {attempts + 1}).")
+        job = VideoJob(**json.loads(payload))
+        self._running += 1
+        self._queued -= 1
+        self._adjust(self._user_queued, job.user_id, -1)
+        self._adjust(self._user_active, job.user_id, 1)
+        return job, False
+
+    def _heartbeat_sync(self, job_id: str, worker_id: str, now: float) -> bool:
+        cursor = self._conn.execute(
+            "UPDATE job_queue SET lease_expires_at = ? WHERE job_id = ? AND lease_owner = ? AND state = 'leased'",
+            (now + self.lease_ttl, job_id, worker_id),
+        )
+        return cursor.rowcount > 0
+
+    def _complete_sync(self, job: VideoJob, worker_id: str):
+        self._conn.execute("DELETE FROM job_queue WHERE job_id = ? AND lease_owner = ?", (job.job_id, worker_id))
+        self._running = max(0, self._running - 1)
+        self._adjust(self._user_active, job.user_id, -1)
+
+    def _abandon_sync(self, job: VideoJob, worker_id: str):
+        # Штатный возврат не считается неудачной попыткой: отменяем приращение из _lease_sync
+        self._conn.execute(
+            "UPDATE job_queue SET state = 'queued', lease_owner = NULL, lease_expires_at = NULL, "
+            "attempts = MAX(attempts - 1, 0) WHERE job_id = ? AND lease_owner = ?",
+            (job.job_id, worker_id),
+        )
+        self._running = max(0, self._running - 1)
+        self._adjust(self._user_active, job.user_id, -1)
+
+    # --- Асинхронный интерфейс ---
+
+    def is_full(self) -> bool:
+        return self._queued >= self.max_queued
+
+    def check(self, user_id: int) -> int:
+        # Быстрая проверка по счетчикам последнего обращения; точная — в submit
+        return self._check_counts(user_id, time.time())
+
+    async def submit(self, job: VideoJob, check_limits: bool = True) -> int:
+        return await self._call(self._submit_sync, job, check_limits, time.time())
+
+    async def charge(self, user_id: int):
+        await self._call(self._charge_sync, user_id, time.time())
+
+    async def lease(self, worker_id: str) -> VideoJob:
+        while True:
+            job, exhausted = await self._call(self._lease_sync, worker_id, time.time())
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+            elif not exhausted:
+                return job
+            elif self.on_exhausted is not None:
+                try:
+                    await self.on_exhausted(job)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка при снятии задачи {job.job_id} с очереди: {e}", exc_info=True)
+
+    async def heartbeat(self, job: VideoJob, worker_id: str) -> bool:
+        return await self._call(self._heartbeat_sync, job.job_id, worker_id, time.time())
+
+    async def complete(self, job: VideoJob, worker_id: str):
+        await self._call(self._complete_sync, job, worker_id)
+
+    async def abandon(self, job: VideoJob, worker_id: str):
+        await self._call(self._abandon_sync, job, worker_id)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return self._queued
@@ -0,0 +1,49 @@
+# rate_limit.py
+import asyncio
+import time
+from typing import Callable
+
+
+class TokenBucket:
+    """
+    Классический token bucket: `rate` токенов в секунду, не больше `capacity` в запасе.
+
+    Часы передаются параметром, чтобы логику можно было проверять с
+    симулированным временем.
+    """
+    def __init__(self, rate: float, capacity: float | None = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def is_full(self) -> bool:
+        """Запас полон: такой bucket ничем не отличается от только что созданного."""
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Забирает токены, если они есть. Не ждет."""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Сколько секунд осталось до появления нужного числа токенов."""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ждет, пока токены появятся, и забирает их."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
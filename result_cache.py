@@ -0,0 +1,126 @@
+# result_cache.py
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+EVICTION_POLICIES = ("lru", "fifo")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_results (
+    result_key   TEXT PRIMARY KEY,
+    file_id      TEXT NOT NULL,
+    created_at   REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits         INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def make_result_key(enhanced_prompt: str, image_hash: str | None, model: str, aspect_ratio: str) -> str:
+    """Адрес результата по содержимому: промпт, хэш входного фото, модель и формат."""
+    payload = "\n".join((model, aspect_ratio, image_hash or "", enhanced_prompt))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Кэш готовых видео: ключ результата -> Telegram file_id.
+
+    Повторный запрос с тем же ключом отвечается пересылкой file_id без нового
+    запуска Veo и без повторной загрузки MP4. Размер ограничен `max_entries`,
+    лишние записи вытесняются по политике `lru` (давно не использованные) или
+    `fifo` (самые старые); записи старше `ttl` секунд не выдаются.
+    """
+    def __init__(self, path: str = "jobs.db", max_entries: int = 5000, policy: str = "lru", ttl: float | None = None):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Неизвестная политика вытеснения: {policy}. Допустимые: {', '.join(EVICTION_POLICIES)}")
+        self.path = path
+        self.max_entries = max_entries
+        self.policy = policy
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache")
+        self._conn: sqlite3.Connection | None = None
+        self.hits = 0
+        self.misses = 0
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open_sync(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+
+    async def open(self):
+        await self._call(self._open_sync)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    def _get_sync(self, key: str) -> str | None:
+        row = self._conn.execute("SELECT file_id, created_at FROM video_results WHERE result_key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        file_id, created_at = row
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            with self._conn:
+                self._conn.execute("DELETE FROM video_results WHERE result_key = ?", (key,))
+            return None
+        with self._conn:
+            self._conn.execute(
+                "UPDATE video_results SET last_used_at = ?, hits = hits + 1 WHERE result_key = ?",
+                (time.time(), key),
+            )
+        return file_id
+
+    def _put_sync(self, key: str, file_id: str):
+        now = time.time()
+        order_column = "last_used_at" if self.policy == "lru" else "created_at"
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO video_results (result_key, file_id, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, file_id, now, now),
+            )
+            self._conn.execute(
+                f"DELETE FROM video_results WHERE result_key IN ("
+                f"SELECT result_key FROM video_results ORDER BY {order_column} DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def _delete_sync(self, key: str):
+        with self._conn:
+            self._conn.execute("DELETE FROM video_results WHERE result_key = ?", (key,))
+
+    async def get(self, key: str) -> str | None:
+        try:
+            file_id = await self._call(self._get_sync, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения кэша результатов: {e}")
+            return None
+        if file_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return file_id
+
+    async def put(self, key: str, file_id: str):
+        try:
+            await self._call(self._put_sync, key, file_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка записи в кэш результатов: {e}")
+
+    async def invalidate(self, key: str):
+        """Удаляет запись (например, если Telegram больше не принимает file_id)."""
+        try:
+            await self._call(self._delete_sync, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка удаления из кэша результатов: {e}")
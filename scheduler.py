@@ -0,0 +1,201 @@
+# scheduler.py
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Callable
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь задач переполнена, новая задача не может быть принята."""
+
+
+class RateLimitedError(Exception):
+    """Пользователь превысил лимит запросов."""
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """
+    Справедливый планировщик задач генерации поверх общей квоты Veo.
+
+    - у каждого пользователя свой token bucket на частоту запросов;
+    - ограничено число задач пользователя в работе и в очереди;
+    - общее число задач в работе не превышает `max_concurrent` (квота Veo);
+    - ожидающие задачи выдаются по кругу между пользователями (round-robin),
+      поэтому один активный пользователь не вытесняет остальных.
+
+    Логика синхронная, а часы передаются параметром, так что планировщик
+    можно проверять с симулированным временем. Асинхронно только ожидание в `get`.
+    Задачи должны иметь атрибут `user_id`.
+
+    Полные token bucket пользователей без задач раз в `BUCKET_PRUNE_INTERVAL`
+    секунд удаляются: при следующем запросе создается такой же новый.
+    """
+    BUCKET_PRUNE_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_queued: int = 100,
+        per_user_in_flight: int = 1,
+        per_user_queued: int = 5,
+        user_rate: float = 1 / 30,
+        user_burst: float = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.per_user_in_flight = per_user_in_flight
+        self.per_user_queued = per_user_queued
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.clock = clock
+
+        # Порядок ключей — очередь обхода round-robin
+        self._queues: OrderedDict[int, deque] = OrderedDict()
+        self._in_flight: dict[int, int] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+        self._pruned_at = clock()
+        self.queued = 0
+        self.running = 0
+        self._changed: asyncio.Event | None = None
+
+    # --- Прием задач ---
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst, clock=self.clock)
+        return bucket
+
+    def _prune_buckets(self):
+        now = self.clock()
+        if now - self._pruned_at < self.BUCKET_PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        idle = [
+            user_id for user_id, bucket in self._buckets.items()
+            if user_id not in self._queues and user_id not in self._in_flight and bucket.is_full()
+        ]
+        for user_id in idle:
+            del self._buckets[user_id]
+
+    def check(self, user_id: int) -> int:
+        """
+        Проверяет, будет ли принята задача пользователя, не занимая места.
+
+        :return: Ожидаемая позиция в очереди (0 — начнется сразу).
+        :raises QueueFullError: если общая или личная очередь заполнена.
+        :raises RateLimitedError: если пользователь превысил лимит запросов.
+        """
+        if self.queued >= self.max_queued:
+            raise QueueFullError()
+        user_queue = self._queues.get(user_id)
+        if user_queue is not None and len(user_queue) >= self.per_user_queued:
+            raise QueueFullError()
+        self._prune_buckets()
+        delay = self._bucket(user_id).delay()
+        if delay > 0:
+            raise RateLimitedError(math.ceil(delay))
+        return self._position(user_id, len(user_queue) if user_queue else 0)
+
+    def charge(self, user_id: int):
+        """
+        Списывает токен пользователя за запрос, который не идет через очередь (например, /image).
+
+        :raises RateLimitedError: если пользователь превысил лимит запросов.
+        """
+        self._prune_buckets()
+        bucket = self._bucket(user_id)
+        if not bucket.try_acquire():
+            raise RateLimitedError(math.ceil(bucket.delay()))
+
+    def submit(self, job, check_limits: bool = True) -> int:
+        """
+        Принимает задачу.
+
+        :param check_limits: False — принять без проверки лимитов (восстановление после перезапуска).
+        :return: Позиция в очереди (0 — будет выдана воркеру сразу).
+        """
+        if check_limits:
+            self.check(job.user_id)
+            self._bucket(job.user_id).try_acquire()
+        user_queue = self._queues.get(job.user_id)
+        index = len(user_queue) if user_queue else 0
+        position = self._position(job.user_id, index)
+        if user_queue is None:
+            user_queue = self._queues[job.user_id] = deque()
+        user_queue.append(job)
+        self.queued += 1
+        self._notify()
+        return position
+
+    def _position(self, user_id: int, index: int) -> int:
+        """Оценка числа задач, которые будут выданы раньше index-й задачи пользователя."""
+        ahead = sum(min(len(q), index + 1) for uid, q in self._queues.items() if uid != user_id) + index
+        free_slots = self.max_concurrent - self.running
+        user_free_slots = self.per_user_in_flight - self._in_flight.get(user_id, 0)
+        return max(0, ahead + 1 - free_slots, index + 1 - user_free_slots)
+
+    # --- Выдача задач ---
+
+    def next_job(self):
+        """Возвращает следующую задачу по кругу или None, если выдать нечего."""
+        if self.running >= self.max_concurrent:
+            return None
+        for user_id in list(self._queues):
+            if self._in_flight.get(user_id, 0) >= self.per_user_in_flight:
+                continue
+            user_queue = self._queues.pop(user_id)
+            job = user_queue.popleft()
+            if user_queue:
+                # Пользователь уходит в конец круга
+                self._queues[user_id] = user_queue
+            self.queued -= 1
+            self._mark_running(user_id)
+            return job
+        return None
+
+    def _mark_running(self, user_id: int):
+        self.running += 1
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+
+    def adopt(self, job):
+        """Учитывает задачу, запущенную в обход очереди (например, восстановленную после перезапуска)."""
+        self._mark_running(job.user_id)
+
+    def release(self, job):
+        """Освобождает слот завершенной задачи."""
+        self.running -= 1
+        count = self._in_flight.get(job.user_id, 0) - 1
+        if count > 0:
+            self._in_flight[job.user_id] = count
+        else:
+            self._in_flight.pop(job.user_id, None)
+        self._notify()
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    async def get(self):
+        """Ждет и возвращает следующую задачу."""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        while True:
+            job = self.next_job()
+            if job is not None:
+                return job
+            self._changed.clear()
+            await self._changed.wait()
+
+    def is_full(self) -> bool:
+        return self.queued >= self.max_queued
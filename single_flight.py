@@ -0,0 +1,54 @@
+# single_flight.py
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов (single-flight).
+
+    Первый вызов с ключом выполняет `fn`, а вызовы с тем же ключом, пришедшие
+    до его завершения, получают тот же результат или то же исключение. Отмена
+    ожидающего вызова не прерывает общий. Если отменен сам первый вызов,
+    ожидающие не получают чужую отмену: один из них повторяет `fn`.
+    """
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        joined = False
+        while (future := self._in_flight.get(key)) is not None:
+            if not joined:
+                self.coalesced += 1
+                joined = True
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling() or not future.cancelled():
+                    raise
+                # Отменен первый вызов, а не этот: пробуем снова (возможно, уже первыми)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; помечаем его полученным,
+            # чтобы не было предупреждения о неизвлеченной ошибке
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
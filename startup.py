@@ -0,0 +1,73 @@
+# startup.py
+import importlib
+import logging
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к его атрибуту.
+
+    Тяжелые SDK (google-genai с моделями pydantic) не нужны, чтобы принять
+    первое обновление, поэтому их импорт не задерживает запуск процесса.
+    """
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            started = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            logger.info(f"Модуль {self._name} загружен за {(time.perf_counter() - started) * 1000:.0f} мс")
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.load(), attr)
+
+
+class LazyObject:
+    """Объект, который создается фабрикой при первом обращении к его атрибуту."""
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._instance = None
+
+    def get(self):
+        if self._instance is None:
+            self._instance = self._factory()
+        return self._instance
+
+    @property
+    def created(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.get(), attr)
+
+
+class StartupTimer:
+    """Разбивка времени запуска по этапам (от старта процесса)."""
+    def __init__(self, process_started: float):
+        self.process_started = process_started
+        self._last = process_started
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self.process_started
+
+    def report(self) -> str:
+        parts = ", ".join(f"{phase} {seconds * 1000:.0f} мс" for phase, seconds in self.phases)
+        return f"{parts}; итого {self.total * 1000:.0f} мс"
@@ -0,0 +1,218 @@
+# telegram_sender.py
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — важнее
+PRIORITY_FINAL = 0     # доставка результата, ответы пользователю
+PRIORITY_STATUS = 1    # промежуточные статусы (правки сообщений)
+PRIORITY_CLEANUP = 2   # удаление служебных сообщений
+
+MAX_RETRIES = 5
+# Как часто удалять bucket чатов, которым давно ничего не отправлялось
+CHAT_BUCKET_EVICT_INTERVAL = 60.0
+
+
+@dataclass
+class _Request:
+    priority: int
+    chat_id: int
+    call: Callable[[], Awaitable[Any]]
+    future: asyncio.Future | None = None
+    key: tuple | None = None
+    retries: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class TelegramSender:
+    """
+    Диспетчер исходящих запросов к Bot API с учетом лимитов Telegram.
+
+    - общий token bucket и отдельный bucket на каждый чат;
+    - при TelegramRetryAfter чат ставится на паузу на `retry_after` секунд,
+      а запрос повторяется, вместо того чтобы превращаться в ошибку задачи;
+    - правки одного и того же статусного сообщения объединяются: если правка
+      еще не отправлена, ее текст просто заменяется последним;
+    - доставка результатов идет раньше промежуточных статусов.
+
+    Bucket чата создается при первом запросе в него и удаляется, когда запас
+    снова полон и запросов в этот чат в очереди нет.
+    """
+    def __init__(self, bot: Bot, global_rate: float = 25.0, per_chat_rate: float = 1.0, per_chat_burst: float = 3.0):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._queues: list[deque[_Request]] = [deque(), deque(), deque()]
+        self._pending_edits: dict[tuple, _Request] = {}
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._paused_until: dict[int, float] = {}
+        self._evicted_at = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._calls: set[asyncio.Task] = set()
+        self.coalesced_edits = 0
+        self.retry_after_hits = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="telegram-sender")
+
+    async def stop(self, timeout: float = 5.0):
+        """Останавливает диспетчер, дав ему `timeout` секунд дослать очередь."""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        tasks = [t for t in (self._task, *self._calls) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues)
+
+    # --- Постановка запросов ---
+
+    def _enqueue(self, request: _Request):
+        self._queues[request.priority].append(request)
+        self._wakeup.set()
+
+    async def send(self, call: Callable[[], Awaitable[Any]], chat_id: int, priority: int = PRIORITY_FINAL):
+        """
+        Выполняет вызов Bot API с учетом лимитов и возвращает его результат.
+
+        :param call: Фабрика корутины, например `lambda: bot.send_message(...)`.
+                     Вызывается заново при каждом повторе.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Request(priority, chat_id, call, future))
+        return await future
+
+    def edit_status(self, chat_id: int, message_id: int, text: str, **kwargs):
+        """Ставит правку статусного сообщения; непосланная предыдущая правка заменяется."""
+        key = (chat_id, message_id)
+        call = lambda: self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            pending.call = call
+            self.coalesced_edits += 1
+            return
+        request = _Request(PRIORITY_STATUS, chat_id, call, key=key)
+        self._pending_edits[key] = request
+        self._enqueue(request)
+
+    def delete(self, chat_id: int, message_id: int):
+        """Удаляет сообщение; отложенная правка этого сообщения отменяется."""
+        key = (chat_id, message_id)
+        pending = self._pending_edits.pop(key, None)
+        if pending is not None and pending in self._queues[PRIORITY_STATUS]:
+            self._queues[PRIORITY_STATUS].remove(pending)
+        self._enqueue(_Request(PRIORITY_CLEANUP, chat_id, lambda: self.bot.delete_message(chat_id=chat_id, message_id=message_id)))
+
+    # --- Отправка ---
+
+    def _chat_delay(self, chat_id: int) -> float:
+        paused = self._paused_until.get(chat_id, 0.0) - time.monotonic()
+        if paused > 0:
+            return paused
+        self._paused_until.pop(chat_id, None)
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket.delay()
+
+    def _evict_idle_buckets(self):
+        now = time.monotonic()
+        if now - self._evicted_at < CHAT_BUCKET_EVICT_INTERVAL:
+            return
+        self._evicted_at = now
+        for chat_id in [chat_id for chat_id, until in self._paused_until.items() if until <= now]:
+            del self._paused_until[chat_id]
+        waiting = {request.chat_id for queue in self._queues for request in queue}
+        idle = [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if chat_id not in waiting and chat_id not in self._paused_until and bucket.is_full()
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    def _next_request(self) -> tuple[_Request | None, float]:
+        """Берет самый важный запрос, чат которого не ограничен сейчас. Иначе — сколько ждать."""
+        wait = float("inf")
+        for queue in self._queues:
+            for request in queue:
+                delay = self._chat_delay(request.chat_id)
+                if delay <= 0:
+                    queue.remove(request)
+                    return request, 0.0
+                wait = min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            self._evict_idle_buckets()
+            request, wait = self._next_request()
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=None if wait == float("inf") else wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Правка уже взята из очереди: пока ждем общий лимит, delete() и
+            # edit_status() не должны ее искать там
+            if request.key is not None:
+                self._pending_edits.pop(request.key, None)
+            await self.global_bucket.acquire()
+            self._chat_buckets[request.chat_id].try_acquire()
+            task = asyncio.create_task(self._execute(request))
+            self._calls.add(task)
+            task.add_done_callback(self._calls.discard)
+
+    async def _execute(self, request: _Request):
+        try:
+            result = await request.call()
+        except TelegramRetryAfter as e:
+            self.retry_after_hits += 1
+            request.retries += 1
+            if request.retries > MAX_RETRIES:
+                self._fail(request, e)
+                return
+            logger.warning(f"Лимит Telegram для чата {request.chat_id}: пауза {e.retry_after} с")
+            self._paused_until[request.chat_id] = time.monotonic() + e.retry_after
+            if request.key is not None:
+                newer = self._pending_edits.get(request.key)
+                if newer is not None:
+                    # Пока ждали, пришла более свежая правка — эта уже не нужна
+                    return
+                self._pending_edits[request.key] = request
+            self._queues[request.priority].appendleft(request)
+            self._wakeup.set()
+            return
+        except Exception as e:
+            self._fail(request, e)
+            return
+        if request.future is not None and not request.future.done():
+            request.future.set_result(result)
+
+    def _fail(self, request: _Request, error: Exception):
+        if request.future is not None:
+            if not request.future.done():
+                request.future.set_exception(error)
+        elif isinstance(error, TelegramBadRequest):
+            # Правка без изменений, уже удаленное сообщение и т.п. — не критично
+            logger.debug(f"Запрос к Telegram отклонен (чат {request.chat_id}): {error}")
+        else:
+            logger.warning(f"Ошибка фонового запроса к Telegram (чат {request.chat_id}): {error}")
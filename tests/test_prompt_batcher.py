@@ -0,0 +1,90 @@
+# tests/test_prompt_batcher.py
+"""PromptBatcher: раздача результатов пакета и переход на одиночные запросы."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from prompt_batcher import BatchParseError, PromptBatcher
+
+
+class StubModel:
+    """Заглушки enhance_one / enhance_batch с записью вызовов."""
+    def __init__(self, batch_result=None, batch_error: Exception | None = None):
+        self.batch_result = batch_result
+        self.batch_error = batch_error
+        self.batch_calls: list[list[str]] = []
+        self.one_calls: list[str] = []
+
+    async def enhance_one(self, prompt: str) -> str:
+        self.one_calls.append(prompt)
+        await asyncio.sleep(0)
+        return f" {prompt} (одиночный) "
+
+    async def enhance_batch(self, prompts: list[str]) -> list:
+        self.batch_calls.append(prompts)
+        await asyncio.sleep(0)
+        if self.batch_error is not None:
+            raise self.batch_error
+        if self.batch_result is not None:
+            return self.batch_result(prompts)
+        return [f" {prompt} (пакет) " for prompt in prompts]
+
+
+def enhance_all(model: StubModel, prompts: list[str], **kwargs) -> list:
+    async def run():
+        batcher = PromptBatcher(model.enhance_one, model.enhance_batch, window=0.01, **kwargs)
+        results = await asyncio.gather(*(batcher.enhance(p) for p in prompts), return_exceptions=True)
+        await batcher.close()
+        return results
+
+    return asyncio.run(run())
+
+
+def test_batch_results_are_returned_to_callers_in_order():
+    model = StubModel()
+    results = enhance_all(model, ["кот", "пес", "маяк"])
+    assert results == ["кот (пакет)", "пес (пакет)", "маяк (пакет)"]
+    assert model.batch_calls == [["кот", "пес", "маяк"]]
+    assert model.one_calls == []
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    model = StubModel()
+    results = enhance_all(model, ["a", "b", "c", "d", "e"], max_batch=2)
+    # Последний промпт ушел одиночным запросом: пакет из одного не собирается
+    assert results == [f"{p} (пакет)" for p in "abcd"] + ["e (одиночный)"]
+    assert model.batch_calls == [["a", "b"], ["c", "d"]]
+    assert model.one_calls == ["e"]
+
+
+def unparsed_response(prompts: list[str]) -> list:
+    raise BatchParseError("ответ не является JSON-массивом")
+
+
+@pytest.mark.parametrize("batch_result", [
+    unparsed_response,
+    lambda prompts: ["только один"],
+    lambda prompts: "не список",
+])
+def test_unparsed_batch_falls_back_to_single_calls(batch_result):
+    model = StubModel(batch_result=batch_result)
+    results = enhance_all(model, ["кот", "пес"])
+    assert results == ["кот (одиночный)", "пес (одиночный)"]
+    assert model.one_calls == ["кот", "пес"]
+
+
+def test_bad_items_fall_back_one_by_one():
+    model = StubModel(batch_result=lambda prompts: ["кот (пакет)", "", None])
+    results = enhance_all(model, ["кот", "пес", "маяк"])
+    assert results == ["кот (пакет)", "пес (одиночный)", "маяк (одиночный)"]
+    assert model.one_calls == ["пес", "маяк"]
+
+
+def test_batch_api_error_is_passed_to_every_waiter():
+    error = RuntimeError("503 UNAVAILABLE")
+    model = StubModel(batch_error=error)
+    results = enhance_all(model, ["кот", "пес", "маяк"])
+    assert results == [error, error, error]
+    assert model.one_calls == []
@@ -0,0 +1,128 @@
+# tests/test_queue_backend.py
+"""
+Общая очередь на SQLite между несколькими процессами.
+
+Воркер, взявший задачу, убивается посреди аренды (SIGKILL, без abandon);
+после истечения аренды задачу должен забрать ровно один из оставшихся воркеров.
+Отдельно — воркер переживает CancelledError, выброшенную самим обработчиком.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import sqlite3
+
+from jobs import JobQueue, VideoJob
+from queue_backend import SqliteQueueBackend
+
+LEASE_TTL = 0.5
+WORKER_RUN_SECONDS = LEASE_TTL * 6
+
+
+def make_backend(path: str) -> SqliteQueueBackend:
+    return SqliteQueueBackend(path, max_concurrent=4, lease_ttl=LEASE_TTL, poll_interval=0.05)
+
+
+def run_stuck_worker(path: str, started):
+    """Берет задачу и зависает в обработчике, пока процесс не убьют."""
+    async def handler(job: VideoJob):
+        started.put(job.job_id)
+        await asyncio.Event().wait()
+
+    async def run():
+        backend = make_backend(path)
+        await backend.open()
+        JobQueue(handler, backend, workers=1, heartbeat_interval=LEASE_TTL / 3).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def run_worker(path: str, handled):
+    """Обрабатывает задачи WORKER_RUN_SECONDS секунд и сообщает, какие задачи достались ему."""
+    async def handler(job: VideoJob):
+        handled.put((os.getpid(), job.job_id))
+
+    async def run():
+        backend = make_backend(path)
+        await backend.open()
+        queue = JobQueue(handler, backend, workers=2, heartbeat_interval=LEASE_TTL / 3)
+        queue.start()
+        await asyncio.sleep(WORKER_RUN_SECONDS)
+        await queue.stop()
+        await backend.close()
+
+    asyncio.run(run())
+
+
+async def submit(path: str, job: VideoJob):
+    backend = make_backend(path)
+    await backend.open()
+    await backend.submit(job)
+    await backend.close()
+
+
+def test_killed_worker_job_is_taken_over_by_exactly_one_worker(tmp_path):
+    path = str(tmp_path / "queue.db")
+    job = VideoJob(chat_id=1, user_id=1, prompt="кот на солнце", status_message_id=10)
+    asyncio.run(submit(path, job))
+
+    ctx = multiprocessing.get_context("spawn")
+    started, handled = ctx.Queue(), ctx.Queue()
+
+    stuck = ctx.Process(target=run_stuck_worker, args=(path, started))
+    stuck.start()
+    try:
+        assert started.get(timeout=30) == job.job_id
+    finally:
+        os.kill(stuck.pid, signal.SIGKILL)
+        stuck.join()
+
+    workers = [ctx.Process(target=run_worker, args=(path, handled)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    results = []
+    while True:
+        try:
+            results.append(handled.get(timeout=1))
+        except queue.Empty:
+            break
+    assert [job_id for _, job_id in results] == [job.job_id]
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM job_queue").fetchone()[0] == 0
+
+
+def test_cancelled_error_from_handler_does_not_stop_the_worker(tmp_path):
+    """CancelledError, которую воркер не запрашивал, не должна завершать его навсегда."""
+    async def run():
+        handled = []
+
+        async def handler(job: VideoJob):
+            handled.append(job.job_id)
+            if len(handled) == 1:
+                raise asyncio.CancelledError()
+
+        backend = make_backend(str(tmp_path / "queue.db"))
+        await backend.open()
+        queue = JobQueue(handler, backend, workers=1, heartbeat_interval=LEASE_TTL / 3)
+        queue.start()
+        jobs = [VideoJob(chat_id=1, user_id=i, prompt="кот", status_message_id=i) for i in range(2)]
+        for job in jobs:
+            await backend.submit(job)
+        async with asyncio.timeout(10):
+            while len(handled) < 2:
+                await asyncio.sleep(0.05)
+        alive = [not task.done() for task in queue._tasks]
+        await queue.stop()
+        await backend.close()
+        return handled, alive, jobs
+
+    handled, alive, jobs = asyncio.run(run())
+    assert handled == [job.job_id for job in jobs]
+    assert alive == [True]
@@ -0,0 +1,173 @@
+# tests/test_scheduler.py
+"""FairScheduler с симулированными часами: порядок выдачи, лимиты и token bucket."""
+from dataclasses import dataclass
+
+import pytest
+
+from scheduler import FairScheduler, QueueFullError, RateLimitedError
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@dataclass
+class Job:
+    user_id: int
+    name: str
+
+
+def make_scheduler(clock: FakeClock, **kwargs) -> FairScheduler:
+    params = dict(max_concurrent=10, max_queued=100, per_user_in_flight=10, per_user_queued=10,
+                  user_rate=1 / 30, user_burst=10)
+    params.update(kwargs)
+    return FairScheduler(clock=clock, **params)
+
+
+def drain(scheduler: FairScheduler) -> list[str]:
+    names = []
+    while (job := scheduler.next_job()) is not None:
+        names.append(job.name)
+    return names
+
+
+def test_jobs_are_handed_out_round_robin_between_users():
+    scheduler = make_scheduler(FakeClock())
+    for name in ("a1", "a2", "a3"):
+        scheduler.submit(Job(1, name))
+    for name in ("b1", "b2"):
+        scheduler.submit(Job(2, name))
+    scheduler.submit(Job(3, "c1"))
+
+    assert drain(scheduler) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+    assert scheduler.queued == 0
+    assert scheduler.running == 6
+
+
+def test_global_quota_limits_jobs_in_flight():
+    scheduler = make_scheduler(FakeClock(), max_concurrent=2)
+    for i in range(3):
+        scheduler.submit(Job(i, f"u{i}"))
+
+    first = scheduler.next_job()
+    assert scheduler.next_job().name == "u1"
+    assert scheduler.next_job() is None
+
+    scheduler.release(first)
+    assert scheduler.next_job().name == "u2"
+
+
+def test_user_in_flight_cap_lets_other_users_through():
+    scheduler = make_scheduler(FakeClock(), per_user_in_flight=1)
+    scheduler.submit(Job(1, "a1"))
+    scheduler.submit(Job(1, "a2"))
+    scheduler.submit(Job(2, "b1"))
+
+    a1 = scheduler.next_job()
+    assert a1.name == "a1"
+    # Вторая задача пользователя 1 ждет, пока не завершится первая
+    assert scheduler.next_job().name == "b1"
+    assert scheduler.next_job() is None
+
+    scheduler.release(a1)
+    assert scheduler.next_job().name == "a2"
+
+
+def test_user_queued_cap_and_global_queue_cap():
+    scheduler = make_scheduler(FakeClock(), max_queued=3, per_user_queued=2)
+    scheduler.submit(Job(1, "a1"))
+    scheduler.submit(Job(1, "a2"))
+    with pytest.raises(QueueFullError):
+        scheduler.submit(Job(1, "a3"))
+
+    scheduler.submit(Job(2, "b1"))
+    assert scheduler.is_full()
+    with pytest.raises(QueueFullError):
+        scheduler.check(3)
+
+
+def test_position_accounts_for_user_in_flight_jobs():
+    scheduler = make_scheduler(FakeClock(), max_concurrent=4, per_user_in_flight=1)
+    assert scheduler.submit(Job(1, "a1")) == 0
+    scheduler.next_job()
+    # Свободных общих слотов много, но личный слот занят задачей a1
+    assert scheduler.check(1) == 1
+    assert scheduler.check(2) == 0
+
+
+def test_token_bucket_refills_with_clock():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, user_rate=1 / 30, user_burst=2)
+    scheduler.submit(Job(1, "a1"))
+    scheduler.submit(Job(1, "a2"))
+
+    with pytest.raises(RateLimitedError) as error:
+        scheduler.submit(Job(1, "a3"))
+    assert error.value.retry_after == 30
+
+    clock.advance(29.5)
+    with pytest.raises(RateLimitedError) as error:
+        scheduler.check(1)
+    # Округление вверх: пользователю не предлагают повторить слишком рано
+    assert error.value.retry_after == 1
+
+    clock.advance(0.5)
+    scheduler.submit(Job(1, "a3"))
+    # Лимит у каждого пользователя свой
+    scheduler.submit(Job(2, "b1"))
+
+
+def test_rejected_submit_does_not_take_a_token():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, per_user_queued=1, user_burst=2)
+    scheduler.submit(Job(1, "a1"))
+    with pytest.raises(QueueFullError):
+        scheduler.submit(Job(1, "a2"))
+
+    scheduler.next_job()
+    scheduler.submit(Job(1, "a2"))
+
+
+def test_restored_jobs_bypass_limits():
+    scheduler = make_scheduler(FakeClock(), per_user_queued=1, user_burst=1)
+    scheduler.submit(Job(1, "a1"))
+    scheduler.submit(Job(1, "a2"), check_limits=False)
+    assert scheduler.queued == 2
+
+
+def test_idle_full_buckets_are_pruned():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, user_rate=1, user_burst=1)
+    for user_id in range(50):
+        scheduler.submit(Job(user_id, f"u{user_id}"))
+    busy = scheduler.next_job()
+    while (job := scheduler.next_job()) is not None:
+        scheduler.release(job)
+
+    clock.advance(FairScheduler.BUCKET_PRUNE_INTERVAL)
+    scheduler.check(100)
+    # Остался bucket пользователя с задачей в работе и только что созданный
+    assert set(scheduler._buckets) == {busy.user_id, 100}
+
+
+def test_charge_uses_the_same_bucket_as_submit():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, user_rate=1 / 30, user_burst=2)
+    scheduler.charge(1)
+    scheduler.submit(Job(1, "a1"))
+
+    with pytest.raises(RateLimitedError) as error:
+        scheduler.charge(1)
+    assert error.value.retry_after == 30
+    with pytest.raises(RateLimitedError):
+        scheduler.check(1)
+
+    clock.advance(30)
+    scheduler.charge(1)
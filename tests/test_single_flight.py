@@ -0,0 +1,120 @@
+# tests/test_single_flight.py
+"""Объединение одинаковых одновременных вызовов: SingleFlight и PromptCache поверх него."""
+import asyncio
+
+import pytest
+
+from prompt_cache import PromptCache
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_with_same_key_share_one_call():
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"value-{key}"
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(
+            *(flights.run("a", lambda: fetch("a")) for _ in range(5)),
+            flights.run("b", lambda: fetch("b")),
+        )
+        return flights, results
+
+    flights, results = asyncio.run(run())
+    assert results == ["value-a"] * 5 + ["value-b"]
+    assert calls == ["a", "b"]
+    assert flights.coalesced == 4
+    assert len(flights) == 0
+
+
+def test_error_is_shared_and_not_remembered():
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.run("k", failing) for _ in range(3)), return_exceptions=True)
+        # Следующий вызов после ошибки снова идет к источнику
+        with pytest.raises(ValueError):
+            await flights.run("k", failing)
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert calls == 2
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        flights = SingleFlight()
+        leader = asyncio.create_task(flights.run("k", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flights.run("k", slow))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await leader, await asyncio.gather(waiter, return_exceptions=True)
+
+    result, (waiter_result,) = asyncio.run(run())
+    assert result == "done"
+    assert isinstance(waiter_result, asyncio.CancelledError)
+
+
+def test_cancelled_leader_lets_waiter_rerun_the_call():
+    calls = 0
+
+    async def slow():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        flights = SingleFlight()
+        leader = asyncio.create_task(flights.run("k", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flights.run("k", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        # Отмена первого вызова не передается ожидающему
+        return await asyncio.gather(leader, return_exceptions=True), await waiter, flights
+
+    (leader_result,), waiter_result, flights = asyncio.run(run())
+    assert isinstance(leader_result, asyncio.CancelledError)
+    assert waiter_result == "done"
+    assert calls == 2
+    assert len(flights) == 0
+
+
+def test_prompt_cache_coalesces_and_caches():
+    calls = []
+
+    async def enhance(prompt):
+        calls.append(prompt)
+        await asyncio.sleep(0.01)
+        return prompt.upper()
+
+    async def run():
+        cache = PromptCache()
+        first = await asyncio.gather(*(cache.get_or_compute("model", "Кот на солнце", enhance) for _ in range(3)))
+        # Нормализованный промпт берется из кэша
+        again = await cache.get_or_compute("model", "  кот на солнце!", enhance)
+        return cache, first, again
+
+    cache, first, again = asyncio.run(run())
+    assert first == ["КОТ НА СОЛНЦЕ"] * 3
+    assert again == "КОТ НА СОЛНЦЕ"
+    assert calls == ["Кот на солнце"]
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "coalesced": 2}
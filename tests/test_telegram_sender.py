@@ -0,0 +1,66 @@
+# tests/test_telegram_sender.py
+"""TelegramSender: объединение правок и удаление статуса под нагрузкой."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from telegram_sender import TelegramSender
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.calls.append(("edit", chat_id, message_id, text))
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(("delete", chat_id, message_id))
+
+
+async def wait_for_calls(bot: FakeBot, count: int):
+    async with asyncio.timeout(2):
+        while len(bot.calls) < count:
+            await asyncio.sleep(0.01)
+
+
+def drain_global_bucket(sender: TelegramSender):
+    while sender.global_bucket.try_acquire():
+        pass
+
+
+def test_edits_of_one_message_are_coalesced():
+    async def run():
+        bot = FakeBot()
+        sender = TelegramSender(bot, global_rate=20.0)
+        sender.edit_status(1, 10, "первый")
+        sender.edit_status(1, 10, "второй")
+        sender.start()
+        await wait_for_calls(bot, 1)
+        await sender.stop()
+        return bot.calls, sender.coalesced_edits
+
+    calls, coalesced = asyncio.run(run())
+    assert calls == [("edit", 1, 10, "второй")]
+    assert coalesced == 1
+
+
+def test_delete_while_edit_waits_for_global_bucket():
+    async def run():
+        bot = FakeBot()
+        sender = TelegramSender(bot, global_rate=20.0)
+        drain_global_bucket(sender)
+        sender.start()
+        sender.edit_status(1, 10, "⏳ генерация")
+        # Диспетчер взял правку из очереди и ждет общий лимит
+        await asyncio.sleep(0)
+        assert sender.pending == 0
+        sender.delete(1, 10)
+        await wait_for_calls(bot, 2)
+        await sender.stop()
+        return bot.calls
+
+    calls = asyncio.run(run())
+    assert calls == [("edit", 1, 10, "⏳ генерация"), ("delete", 1, 10)]